@@ -16,14 +16,14 @@ setup(
     url="https://github.com/SDFIdk/WEBPROJ",
     long_description=readme,
     packages=["webproj", "tests", "app"],
-    install_requires=["fastapi", "pyproj"],
+    install_requires=["fastapi", "httpx", "numpy", "pyproj"],
     test_suite="tests/test_api.py",
     data_files=["webproj/data.json"],
     include_package_data=True,
     zip_safe=False,
     entry_points="""
         [console_scripts]
-        webproj=app.main:run
+        webproj=webproj.cli:main
       """,
     classifiers=[
         "Development Status :: 5 - Production/Stable",
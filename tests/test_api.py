@@ -1,10 +1,35 @@
+import asyncio
+import io
+import json
+import logging
 import re
+import struct
 import pprint
+import threading
+import time
 
+import httpx
 import pytest
+from pyproj import CRS
+from pyproj.transformer import TransformerGroup
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
 
-from webproj.api import app, TransformerFactory
+from webproj import api, cli, client, profiler, selection, slowlog, verify
+from webproj.admission import Gate
+from webproj.api import (
+    app,
+    ADMISSION,
+    TransformerFactory,
+    OptimusPrime,
+    _make_4d,
+    reload_registry,
+    AOI,
+)
+from webproj.grids import grids_in_definition, load_grid
+from webproj.approx import Mesh
+from webproj.parallel import ShardedTransformer
+from webproj.selection import fastest_transformer
 
 
 def _get_and_decode_response(entry):
@@ -391,3 +416,1030 @@ def test_info(api_from_v1_2):
     for software, version_number in response.items():
         print(software, version_number)
         assert re.match(r"^\d+\.\d+\.\d+$", version_number)
+
+
+def test_trans_batch(api_from_v1_2):
+    """
+    Test that batches of coordinates are transformed like single coordinates
+    """
+    client = TestClient(app)
+    response = client.post(
+        f"/{api_from_v1_2}/trans/EPSG:4258/EPSG:25832",
+        json=[[56.0, 12.0], [56.0, 12.0]],
+    )
+    expected = {
+        "v1": 687071.4391094431,
+        "v2": 6210141.326748009,
+        "v3": None,
+        "v4": None,
+    }
+    assert response.json() == [expected, expected]
+
+    response = client.post(
+        f"/{api_from_v1_2}/trans/EPSG:4258/EPSG:25832",
+        json=[[56.0, 12.0], [56.0, 12.0, 30.0]],
+    )
+    assert response.status_code == 400
+
+
+def test_sharded_batch():
+    """
+    Test that sharded batches match the scalar transformation
+    """
+    sharded = ShardedTransformer(
+        create=TransformerFactory.create, workers=4, threshold=3
+    )
+    lats = [54.6 + 0.1 * i for i in range(30)]
+    lons = [8.1 + 0.2 * i for i in range(30)]
+    hgts = [float(i) for i in range(30)]
+
+    (v1, v2, v3, v4) = sharded.transform("EPSG:4258", "EPSG:25832", (lats, lons, hgts))
+    sharded.shutdown()
+
+    transformer = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+    for i, coord in enumerate(zip(lats, lons, hgts)):
+        assert transformer.transform(_make_4d(coord)) == (v1[i], v2[i], v3[i], None)
+    assert v4 is None
+
+
+def test_admission_gate():
+    """
+    Test that requests beyond the concurrency and queue limits are rejected
+    """
+
+    async def scenario():
+        gate = Gate(concurrency=1, queue_size=1)
+        assert await gate.acquire()
+
+        waiting = asyncio.create_task(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.queued == 1
+
+        # both the slot and the queue are taken
+        assert not await gate.acquire()
+
+        gate.release()
+        assert await waiting
+        assert gate.status() == {
+            "concurrency": 1,
+            "queue_size": 1,
+            "in_flight": 1,
+            "queued": 0,
+        }
+        gate.release()
+        assert gate.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_admission_rejection():
+    """
+    Test that rejected requests get a 503 with a Retry-After header
+    """
+    gate = ADMISSION["batch"]
+    (concurrency, queue_size) = (gate.concurrency, gate.queue_size)
+    gate.concurrency, gate.queue_size = 1, 0
+    gate.in_flight = 1
+    try:
+        client = TestClient(app)
+        response = client.post("/v1.2/trans/EPSG:4258/EPSG:25832", json=[[56.0, 12.0]])
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+
+        # metadata requests are unaffected
+        response = client.get("/v1.2/crs/EPSG:25832")
+        assert response.status_code == 200
+
+        response = client.get("/v1.2/load/")
+        assert response.json()["batch"]["in_flight"] == 1
+    finally:
+        gate.concurrency, gate.queue_size = concurrency, queue_size
+        gate.in_flight = 0
+
+
+def test_admin_transformers(monkeypatch):
+    """
+    Test that the cached transformers can be inspected by admins only
+    """
+    client = TestClient(app)
+    response = client.get("/admin/transformers/")
+    assert response.status_code == 404
+
+    monkeypatch.setenv("WEBPROJ_ADMIN_TOKEN", "secret")
+    response = client.get("/admin/transformers/", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403
+
+    transformer = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+    hits = transformer.hits
+
+    response = client.get("/admin/transformers/", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    cached = {(t["src"], t["dst"]): t for t in response.json()}
+    entry = cached[("EPSG:4258", "EPSG:25832")]
+    assert list(entry["stages"].keys()) == ["epsg"]
+    assert "utm" in entry["stages"]["epsg"]["definition"]
+    assert entry["hits"] == hits
+    assert entry["memory_estimate"] > 0
+
+
+def test_grids_in_definition():
+    """
+    Test that grids are picked up from PROJ definitions
+    """
+    definition = (
+        "+proj=pipeline +step +proj=hgridshift +grids=@a.tif,b.tif "
+        "+step +proj=vgridshift +geoidgrids=c.tif +multiplier=1"
+    )
+    assert grids_in_definition(definition) == ["a.tif", "b.tif", "c.tif"]
+
+
+def test_shared_legs():
+    """
+    Test that transformations share legs instead of building their own
+    """
+    transformer_a = OptimusPrime("EPSG:25832", "EPSG:4258")
+    transformer_b = OptimusPrime("EPSG:25832", "EPSG:4258")
+
+    assert transformer_a is not transformer_b
+    assert transformer_a.epsg_pipeline is transformer_b.epsg_pipeline
+
+
+def test_shared_hub_legs():
+    """
+    Test that transformations through the ETRS89 hub share the legs to
+    and from the hub
+    """
+    to_utm = OptimusPrime("DK:S34J", "EPSG:25832")
+    to_geo = OptimusPrime("DK:S34J", "EPSG:4258")
+    assert to_utm.pre_pipeline is to_geo.pre_pipeline
+
+    to_s34j = OptimusPrime("EPSG:25832", "DK:S34J")
+    to_s34s = OptimusPrime("EPSG:25832", "DK:S34S")
+    assert to_s34j.epsg_pipeline is to_s34s.epsg_pipeline
+    assert to_s34j.post_pipeline is not to_s34s.post_pipeline
+
+
+def test_catalogue(api_from_v1_2):
+    """
+    Test that the catalogue contains the CRS info of all CRS's
+    """
+    client = TestClient(app)
+    response = client.get(f"/{api_from_v1_2}/catalogue/")
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    catalogue = response.json()
+    assert list(catalogue.keys()) == list(app.CRS_LIST.keys())
+    for srid in ["EPSG:25832", "EPSG:23032+5733", "DK:S34S"]:
+        assert catalogue[srid] == _get_and_decode_response(
+            f"/{api_from_v1_2}/crs/{srid}"
+        )
+
+    response = client.get(f"/{api_from_v1_2}/catalogue/?country=GL")
+    assert {crsinfo["country"] for crsinfo in response.json().values()} == {"GL"}
+
+    response = client.get(f"/{api_from_v1_2}/catalogue/?country=SE")
+    assert response.status_code == 400
+
+
+def test_stream(api_from_v1_2):
+    """
+    Test that coordinates can be streamed through a websocket
+    """
+    client = TestClient(app)
+    with client.websocket_connect(
+        f"/{api_from_v1_2}/stream/EPSG:4258/EPSG:25832"
+    ) as websocket:
+        websocket.send_text("[56.0,12.0]")
+        (v1, v2) = websocket.receive_json()
+        assert abs(v1 - 687071.4391094431) < 1e-6
+        assert abs(v2 - 6210141.326748009) < 1e-6
+
+        websocket.send_text("[[56.0,12.0,30.0],[56.0,12.0,30.0]]")
+        reply = websocket.receive_json()
+        assert len(reply) == 2
+        assert reply[0] == reply[1]
+        assert abs(reply[0][2] - 30.0) < 1e-6
+
+        websocket.send_text("[[56.0,12.0],[56.0]]")
+        assert "detail" in websocket.receive_json()
+
+        message = [[56.0, 12.0]] * (api.MAX_STREAM_COORDINATES + 1)
+        websocket.send_text(json.dumps(message))
+        assert "at most" in websocket.receive_json()["detail"]
+
+        websocket.send_bytes(b"[56.0,12.0]")
+        assert websocket.receive_json()["detail"] == "Messages must be text frames"
+
+        # the stream is still open after a binary frame
+        websocket.send_text("[56.0,12.0]")
+        assert len(websocket.receive_json()) == 2
+
+    with client.websocket_connect(
+        f"/{api_from_v1_2}/stream/EPSG:4258/EPSG:0"
+    ) as websocket:
+        with pytest.raises(WebSocketDisconnect) as error:
+            websocket.receive_text()
+        assert error.value.code == 1008
+
+
+def test_trans_bounds(api_from_v1_2):
+    """
+    Test that bounding boxes and rings are densified and transformed
+    """
+    client = TestClient(app)
+    entry = f"/{api_from_v1_2}/trans/EPSG:4258/EPSG:25832/bounds"
+
+    response = client.post(entry, json={"bbox": [55.0, 7.0, 56.0, 11.0], "densify": 0})
+    corners = response.json()
+    assert len(corners["ring"]) == 5
+
+    response = client.post(entry, json={"bbox": [55.0, 7.0, 56.0, 11.0]})
+    densified = response.json()
+    assert len(densified["ring"]) == 4 * 22 + 1
+
+    # the lower edge curves below the corners around the central meridian
+    assert densified["bbox"][1] < corners["bbox"][1]
+
+    transformer = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+    (v1, v2, _, _) = transformer.transform((55.0, 7.0, None, None))
+    assert densified["ring"][0] == [v1, v2]
+
+    ring = [[55.0, 9.0], [56.0, 9.0], [56.0, 12.0], [55.0, 9.0]]
+    response = client.post(entry, json={"ring": ring, "densify": 1})
+    assert len(response.json()["ring"]) == 3 * 2 + 1
+
+    response = client.post(entry, json={"ring": ring, "bbox": [55.0, 9.0, 56.0, 12.0]})
+    assert response.status_code == 400
+
+    # 3000 vertices densified with 1000 points each are too many
+    ring = [[55.0 + i / 3000, 9.0 + (i % 2) / 10] for i in range(3000)]
+    response = client.post(entry, json={"ring": ring, "densify": 1000})
+    assert response.status_code == 400
+
+
+def test_trans_bounds_clipped():
+    """
+    Test that bounding boxes are clipped to the area of use
+    """
+    client = TestClient(app)
+    entry = "/v1.2/trans/EPSG:4258/EPSG:25832/bounds"
+    (_, (west, south, east, north)) = api._area_of_use("EPSG:4258", "EPSG:25832")
+
+    response = client.post(entry, json={"bbox": [south, west, north, east]})
+    area = response.json()["bbox"]
+
+    response = client.post(entry, json={"bbox": [30.0, -60.0, 80.0, 60.0]})
+    assert response.status_code == 200
+    clipped = response.json()["bbox"]
+    for a, b in zip(clipped, area):
+        assert abs(a - b) < 1e-3
+
+    response = client.post(entry, json={"bbox": [50.0, 8.0, 70.0, 30.0]})
+    (v1_min, v2_min, v1_max, v2_max) = response.json()["bbox"]
+    assert v1_max == pytest.approx(area[2], abs=1e-3)
+    assert v1_min > area[0]
+
+    response = client.post(entry, json={"bbox": [10.0, 100.0, 20.0, 110.0]})
+    assert response.status_code == 404
+
+
+def test_reload_registry(monkeypatch, tmp_path):
+    """
+    Test that reloading the registry only drops the affected transformers
+    """
+    original = api._DATA
+    registry = json.loads(original.read_text(encoding="UTF-8"))
+    registry["EPSG:25833"]["title"] = "Changed title"
+    del registry["EPSG:4096"]
+    data = tmp_path / "data.json"
+    data.write_text(json.dumps(registry), encoding="UTF-8")
+
+    kept = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+    dropped = TransformerFactory.create("EPSG:4258", "EPSG:25833")
+    kept_mesh = object()
+    monkeypatch.setattr(
+        api.MeshFactory,
+        "meshes",
+        {("EPSG:4258", "EPSG:25832"): kept_mesh, ("EPSG:4258", "EPSG:25833"): object()},
+    )
+
+    client = TestClient(app)
+    monkeypatch.setenv("WEBPROJ_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(api, "_DATA", data)
+    try:
+        response = client.post("/admin/reload/", headers={"X-Admin-Token": "secret"})
+        assert response.status_code == 200
+        report = response.json()
+        assert report["changed"] == ["EPSG:25833"]
+        assert report["removed"] == ["EPSG:4096"]
+        assert report["added"] == []
+        assert report["invalidated_transformers"] >= 1
+
+        assert app.CRS_LIST["EPSG:25833"]["title"] == "Changed title"
+        assert "EPSG:4096" not in app.CRS_LIST
+        assert TransformerFactory.create("EPSG:4258", "EPSG:25832") is kept
+        assert TransformerFactory.create("EPSG:4258", "EPSG:25833") is not dropped
+        assert report["invalidated_meshes"] == 1
+        assert api.MeshFactory.meshes[("EPSG:4258", "EPSG:25832")] is kept_mesh
+        assert ("EPSG:4258", "EPSG:25833") not in api.MeshFactory.meshes
+    finally:
+        monkeypatch.setattr(api, "_DATA", original)
+        report = reload_registry()
+        assert report["added"] == ["EPSG:4096"]
+
+
+def test_reload_registry_failure(monkeypatch, tmp_path):
+    """
+    Test that a reload that fails while dropping cached transformers is
+    redone in full by the next reload
+    """
+    original = api._DATA
+    registry = json.loads(original.read_text(encoding="UTF-8"))
+    registry["EPSG:25833"]["title"] = "Changed title"
+    data = tmp_path / "data.json"
+    data.write_text(json.dumps(registry), encoding="UTF-8")
+
+    dropped = TransformerFactory.create("EPSG:4258", "EPSG:25833")
+
+    def fail(srids, legs):
+        raise RuntimeError("dictionary changed size during iteration")
+
+    monkeypatch.setattr(api, "_DATA", data)
+    try:
+        with monkeypatch.context() as patch:
+            patch.setattr(TransformerFactory, "invalidate", fail)
+            with pytest.raises(RuntimeError):
+                reload_registry()
+
+        report = reload_registry()
+        assert report["changed"] == ["EPSG:25833"]
+        assert report["invalidated_transformers"] >= 1
+        assert TransformerFactory.create("EPSG:4258", "EPSG:25833") is not dropped
+    finally:
+        monkeypatch.setattr(api, "_DATA", original)
+        reload_registry()
+
+
+def test_slow_request_log(monkeypatch):
+    """
+    Test that slow requests are logged with details of the transformation
+    """
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(json.loads(record.getMessage()))
+
+    capture = Capture()
+    slowlog.LOGGER.addHandler(capture)
+    monkeypatch.setattr(slowlog, "THRESHOLD", 0.0)
+    try:
+        client = TestClient(app)
+        client.get("/v1.2/trans/EPSG:4258/EPSG:25832/56.0,12.0,30.0")
+    finally:
+        slowlog.LOGGER.removeHandler(capture)
+
+    (record,) = records
+    assert record["route"] == "/v1.2/trans/{src}/{dst}/{v}"
+    assert record["status"] == 200
+    assert record["src"] == "EPSG:4258"
+    assert record["dst"] == "EPSG:25832"
+    assert record["dimension"] == 3
+    assert record["cache"] in ("hit", "miss")
+    assert "epsg" in record["stages"]
+
+
+def test_slow_request_log_pairs(monkeypatch):
+    """
+    Test that requests are logged with their own CRS pair, not those of the
+    transformers used by helpers, and that a miss is not logged as a hit
+    """
+    records = []
+
+    class Capture(logging.Handler):
+        def emit(self, record):
+            records.append(json.loads(record.getMessage()))
+
+    capture = Capture()
+    slowlog.LOGGER.addHandler(capture)
+    monkeypatch.setattr(slowlog, "THRESHOLD", 0.0)
+    TransformerFactory.transformers.get("EPSG:4258", {}).pop("EPSG:25832", None)
+    try:
+        client = TestClient(app)
+        client.post(
+            "/v1.2/trans/EPSG:4258/EPSG:25832/bounds",
+            json={"bbox": [55.0, 7.0, 56.0, 11.0]},
+        )
+        client.post(
+            "/v1.2/fanout/EPSG:4258",
+            json={
+                "coordinates": [[56.0, 12.0]],
+                "targets": ["EPSG:25832", "EPSG:4326"],
+            },
+        )
+    finally:
+        slowlog.LOGGER.removeHandler(capture)
+
+    (bounds, fanout) = records
+    assert (bounds["src"], bounds["dst"]) == ("EPSG:4258", "EPSG:25832")
+    assert bounds["cache"] == "miss"
+    assert (fanout["src"], fanout["dst"]) == ("EPSG:4258", "EPSG:25832,EPSG:4326")
+    assert fanout["points"] == 1
+
+
+def test_fastest_transformer():
+    """
+    Test that only operations as accurate as the preferred operation and
+    covering its area of use are considered when selecting the fastest
+    """
+    (transformer, selection) = fastest_transformer(
+        CRS("EPSG:4230").to_3d(), CRS("EPSG:4258").to_3d(), AOI["DK"]
+    )
+
+    # ED50 to ETRS89 (15) is just as accurate, but only covers the North Sea
+    assert transformer is None
+    assert [c["description"] for c in selection["candidates"]] == [
+        "ED50 to ETRS89 (4)"
+    ]
+    assert selection["selected"] == "ED50 to ETRS89 (4)"
+    assert selection["candidates"][0]["time"] > 0
+
+
+def test_fastest_transformer_sample_points():
+    """
+    Test that candidates are benchmarked on points inside the area of use,
+    given in the axis order of the source CRS
+    """
+    crs_from = CRS("EPSG:4230").to_3d()
+    crs_to = CRS("EPSG:4258").to_3d()
+    group = TransformerGroup(crs_from, crs_to, area_of_interest=AOI["DK"])
+    preferred = group.transformers[0]
+    aoi = AOI["DK"]
+    (west, south, east, north) = selection._intersection(
+        preferred.area_of_use.bounds,
+        (
+            aoi.west_lon_degree,
+            aoi.south_lat_degree,
+            aoi.east_lon_degree,
+            aoi.north_lat_degree,
+        ),
+    )
+
+    points = selection._sample_points(crs_from, (west, south, east, north))
+    (lats, lons, _) = preferred.transform(*points)
+    for lat, lon in zip(lats, lons):
+        assert south - 0.01 <= lat <= north + 0.01
+        assert west - 0.01 <= lon <= east + 0.01
+
+
+def test_fanout(api_from_v1_2):
+    """
+    Test that a coordinate can be transformed to many CRS's at once
+    """
+    client = TestClient(app)
+    response = client.post(
+        f"/{api_from_v1_2}/fanout/EPSG:4258",
+        json={
+            "coordinates": [[56.0, 12.0]],
+            "targets": ["EPSG:25832", "EPSG:4326", "EPSG:4909", "EPSG:0"],
+        },
+    )
+    results = response.json()
+
+    (coordinate,) = results["EPSG:25832"]["coordinates"]
+    assert abs(coordinate["v1"] - 687071.4391094431) < 1e-6
+    assert abs(coordinate["v2"] - 6210141.326748009) < 1e-6
+    assert coordinate["v3"] is None
+
+    assert results["EPSG:4326"]["coordinates"][0] is not None
+    assert results["EPSG:4909"]["detail"] == "CRS's are not compatible across countries"
+    assert results["EPSG:0"]["detail"] == "Unknown destination CRS identifier: 'EPSG:0'"
+
+    response = client.post(
+        f"/{api_from_v1_2}/fanout/EPSG:25832",
+        json={"coordinates": [[687071.4, 6210141.3]]},
+    )
+    targets = set(response.json().keys())
+    expected = {
+        srid
+        for srid, crsinfo in app.CRS_LIST.items()
+        if crsinfo["country"] in ("DK", "Global")
+    }
+    assert targets == expected
+
+    # a global source fails only for global targets
+    response = client.post(
+        f"/{api_from_v1_2}/fanout/EPSG:4326",
+        json={"coordinates": [[56.0, 12.0]], "targets": ["EPSG:3857", "EPSG:25832"]},
+    )
+    assert response.status_code == 200
+    results = response.json()
+    assert results["EPSG:3857"]["detail"] == (
+        "Global CRS's are only compatible with regional CRS's"
+    )
+    assert results["EPSG:25832"]["coordinates"][0] is not None
+
+
+def test_fanout_equals_batch():
+    """
+    Test that fan-out gives the same results as the batch endpoint
+    """
+    client = TestClient(app)
+    coordinates = [[55.0 + i / 10, 8.0 + i / 5, 10.0 * i] for i in range(20)]
+    targets = ["EPSG:23032", "EPSG:25832", "EPSG:3857", "EPSG:4326", "EPSG:4258"]
+
+    response = client.post(
+        "/v1.2/fanout/EPSG:4230",
+        json={"coordinates": coordinates, "targets": targets},
+    )
+    results = response.json()
+
+    for target in targets:
+        response = client.post(f"/v1.2/trans/EPSG:4230/{target}", json=coordinates)
+        assert results[target]["coordinates"] == response.json()
+
+
+def test_approximate_batch(monkeypatch):
+    """
+    Test that approximate batch transformations are within tolerance of the
+    exact transformation and fall back to it outside the mesh
+    """
+    client = TestClient(app)
+    coordinates = [
+        [55.0 + i / 50, 8.0 + j / 25, 10.0 * i] for i in range(50) for j in range(50)
+    ]
+    coordinates.append([54.0, 2.0, 0.0])  # outside the mesh
+    coordinates.append([56.0, 12.0, 5000.0])  # outside the height range
+
+    # meshes that aren't faster than the exact transformation are discarded
+    monkeypatch.setattr(Mesh, "speedup", lambda self: 0.5)
+    assert api.MeshFactory._build("EPSG:4258", "EPSG:25832") is None
+    monkeypatch.setattr(Mesh, "speedup", lambda self: 2.0)
+    mesh = api.MeshFactory._build("EPSG:4258", "EPSG:25832")
+    assert mesh.coverage > 0.9
+    assert mesh.max_error < 0.0005
+    monkeypatch.setitem(api.MeshFactory.meshes, ("EPSG:4258", "EPSG:25832"), mesh)
+
+    entry = "/v1.2/trans/EPSG:4258/EPSG:25832"
+    exact = client.post(entry, json=coordinates).json()
+    approx = client.post(f"{entry}?approximate=true", json=coordinates).json()
+
+    assert len(approx) == len(exact)
+    assert approx != exact
+    for a, e in zip(approx, exact):
+        assert abs(a["v1"] - e["v1"]) < 0.0005
+        assert abs(a["v2"] - e["v2"]) < 0.0005
+        assert abs(a["v3"] - e["v3"]) < 0.0005
+        assert a["v4"] is None
+    assert approx[-2:] == exact[-2:]
+
+    # large batches are sharded
+    monkeypatch.setattr(api.SHARDED_TRANSFORMER, "threshold", 100)
+    assert client.post(f"{entry}?approximate=true", json=coordinates).json() == approx
+
+    coordinates = [[55.0, 8.0, 0.0, 2020.0], [56.0, 9.0, 0.0, 2020.0]]
+    exact = client.post(entry, json=coordinates).json()
+    approx = client.post(f"{entry}?approximate=true", json=coordinates).json()
+    assert approx == exact
+
+
+def test_mesh_factory(monkeypatch):
+    """
+    Test that a mesh is built once for concurrent callers, and in the
+    background for requests, which are transformed exactly meanwhile
+    """
+    built = []
+
+    def build(src, dst):
+        built.append((src, dst))
+        time.sleep(0.2)
+        return "mesh"
+
+    monkeypatch.setattr(api.MeshFactory, "_build", staticmethod(build))
+    monkeypatch.setattr(api.MeshFactory, "meshes", {})
+
+    assert api.MeshFactory.create("EPSG:4258", "EPSG:25833", wait=False) is None
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(
+                api.MeshFactory.create("EPSG:4258", "EPSG:25833")
+            )
+        )
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["mesh"] * 4
+    assert built == [("EPSG:4258", "EPSG:25833")]
+
+
+def test_approximate_border_cells():
+    """
+    Test that coordinates in the border cells of a mesh, which can't be
+    interpolated, are transformed exactly
+    """
+    transformer = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+    mesh = Mesh(transformer, (54.5, 8.0, 57.5, 12.0), size=32)
+    (step1, step2) = mesh.step
+    columns = (
+        [54.5 + step1 / 2, 56.0, 57.5 - step1 / 2, 56.0],
+        [10.0, 8.0 + step2 / 2, 10.0, 12.0 - step2 / 2],
+        [0.0, 0.0, 0.0, 0.0],
+    )
+    assert mesh.transform_batch(columns) == transformer.transform_batch(columns)
+
+
+def test_regions(monkeypatch):
+    """
+    Test that an instance restricted to a region only serves the CRS's of
+    that region and global CRS's, and reports excluded CRS's as such
+    """
+    client = TestClient(app)
+    monkeypatch.setattr(api, "REGIONS", {"DK"})
+    try:
+        reload_registry()
+        assert {crsinfo["country"] for crsinfo in app.CRS_LIST.values()} == {
+            "DK",
+            "Global",
+        }
+        assert client.get("/v1.2/crs/").json()["GL"] == []
+
+        response = client.get("/v1.2/crs/EPSG:3184")
+        assert response.json()["detail"] == (
+            "'EPSG:3184' belongs to region GL, which is not served by this instance"
+        )
+        response = client.get("/v1.2/trans/EPSG:4909/EPSG:3184/64.0,-51.0")
+        assert response.status_code == 400
+        assert "not served by this instance" in response.json()["detail"]
+        response = client.get("/v1.2/catalogue/?country=GL")
+        assert response.json()["detail"] == (
+            "Country 'GL' is not served by this instance"
+        )
+        response = client.get("/v1.2/crs/EPSG:0")
+        assert response.json()["detail"] == "'EPSG:0' not available."
+
+        _assert_coordinate(
+            "/v1.2/trans/EPSG:4258/EPSG:25832/56.0,12.0",
+            {"v1": 687071.4391094431, "v2": 6210141.326748009, "v3": None, "v4": None},
+        )
+
+        monkeypatch.setattr(api, "REGIONS", {"XX"})
+        with pytest.raises(ValueError):
+            reload_registry()
+    finally:
+        monkeypatch.setattr(api, "REGIONS", None)
+        reload_registry()
+
+    assert "EPSG:3184" in app.CRS_LIST
+
+
+def test_admin_profile(monkeypatch):
+    """
+    Test that the profiler samples transformations in other threads and
+    returns collapsed stacks
+    """
+    client = TestClient(app)
+    monkeypatch.setenv("WEBPROJ_ADMIN_TOKEN", "secret")
+    headers = {"X-Admin-Token": "secret"}
+
+    done = threading.Event()
+
+    def work():
+        while not done.is_set():
+            transformer = TransformerFactory.create("EPSG:4258", "EPSG:25832")
+            transformer.transform((55.0, 9.0, 0.0, None))
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    try:
+        response = client.get("/admin/profile/?seconds=0.5", headers=headers)
+    finally:
+        done.set()
+        thread.join()
+
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Samples"]) > 0
+    lines = response.text.splitlines()
+    assert all(re.match(r"^\S.* \d+$", line) for line in lines)
+    assert any("webproj.api:OptimusPrime.transform" in line for line in lines)
+
+    with profiler._LOCK:
+        response = client.get("/admin/profile/?seconds=0.1", headers=headers)
+    assert response.status_code == 409
+
+    response = client.get("/admin/profile/?seconds=0", headers=headers)
+    assert response.status_code == 400
+
+
+def test_client():
+    """
+    Test that the client batches single coordinate calls, caches results
+    and gives the same results as the API
+    """
+    http = TestClient(app)
+    requests = []
+    http.event_hooks = {"request": [requests.append]}
+
+    coordinates = [(55.0 + i / 100, 9.0 + i / 100) for i in range(50)]
+    with client.Client(http=http, batch_delay=0.05) as webproj:
+        futures = [webproj.submit("EPSG:4258", "EPSG:25832", c) for c in coordinates]
+        results = [future.result() for future in futures]
+        assert [r.method for r in requests] == ["POST"]
+
+        for coordinate, result in zip(coordinates[:3], results):
+            entry = "/v1.2/trans/EPSG:4258/EPSG:25832/{},{}".format(*coordinate)
+            _assert_coordinate(entry, result)
+
+        # cached results are not requested again
+        assert (
+            webproj.transform("EPSG:4258", "EPSG:25832", coordinates[0]) == results[0]
+        )
+        assert (
+            webproj.transform_batch("EPSG:4258", "EPSG:25832", coordinates) == results
+        )
+        assert len(requests) == 1
+
+        assert webproj.crs("EPSG:25832")["country"] == "DK"
+        webproj.crs("epsg:25832")
+        assert len(requests) == 2
+
+        with pytest.raises(client.WebprojError) as error:
+            webproj.transform("EPSG:4258", "EPSG:0", (55.0, 9.0))
+        assert error.value.status_code == 400
+
+
+def test_client_transform_batch_outside():
+    """
+    Test that coordinates outside the area of use don't fail the rest of
+    the batch
+    """
+    coordinates = [(55.0 + i / 100, 9.0) for i in range(10)]
+    coordinates[3] = (95.0, 9.0)
+
+    with client.Client(http=TestClient(app)) as webproj:
+        results = webproj.transform_batch("EPSG:4258", "EPSG:25832", coordinates)
+    assert results[3] is None
+    assert all(r is not None for i, r in enumerate(results) if i != 3)
+    _assert_coordinate("/v1.2/trans/EPSG:4258/EPSG:25832/55.0,9.0", results[0])
+
+    async def run():
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+        )
+        async with client.AsyncClient(http=http) as webproj:
+            return await webproj.transform_batch(
+                "EPSG:4258", "EPSG:25832", coordinates
+            )
+
+    assert asyncio.run(run()) == results
+
+
+def test_client_retry():
+    """
+    Test that the client retries requests rejected with 503
+    """
+    replies = [503, 503, 200]
+
+    def handler(request):
+        status_code = replies.pop(0)
+        if status_code == 503:
+            return httpx.Response(
+                503, json={"detail": "busy"}, headers={"Retry-After": "0"}
+            )
+        coordinates = json.loads(request.content)
+        return httpx.Response(200, json=[{"v1": c[0], "v2": c[1]} for c in coordinates])
+
+    http = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://test")
+    with client.Client(http=http, backoff=0.001) as webproj:
+        assert webproj.transform("EPSG:4258", "EPSG:4258", (1.0, 2.0)) == {
+            "v1": 1.0,
+            "v2": 2.0,
+        }
+    assert not replies
+
+    replies = [503] * 3
+    http = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://test")
+    with client.Client(http=http, backoff=0.001, retries=2) as webproj:
+        with pytest.raises(client.WebprojError) as error:
+            webproj.transform("EPSG:4258", "EPSG:4258", (1.0, 2.0))
+    assert error.value.status_code == 503
+
+
+def test_client_transform_threads():
+    """
+    Test that a single thread's transform() calls don't wait for a batch
+    and that concurrent calls from several threads are batched
+    """
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        time.sleep(0.1)
+        coordinates = json.loads(request.content)
+        return httpx.Response(200, json=[{"v1": c[0], "v2": c[1]} for c in coordinates])
+
+    http = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://test")
+    with client.Client(http=http, batch_delay=60.0) as webproj:
+        start = time.monotonic()
+        for i in range(3):
+            webproj.transform("EPSG:4258", "EPSG:4258", (1.0, float(i)))
+        assert time.monotonic() - start < 30.0
+        assert len(requests) == 3
+
+    requests.clear()
+    barrier = threading.Barrier(10)
+
+    def call(i):
+        barrier.wait()
+        webproj.transform("EPSG:4258", "EPSG:4258", (2.0, float(i)))
+
+    http = httpx.Client(transport=httpx.MockTransport(handler), base_url="http://test")
+    with client.Client(http=http, batch_delay=0.5) as webproj:
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert len(requests) < 10
+
+
+def test_async_client():
+    """
+    Test that the async client batches concurrent calls
+    """
+
+    async def run():
+        requests = []
+
+        async def record(request):
+            requests.append(request)
+
+        http = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://testserver",
+            event_hooks={"request": [record]},
+        )
+        async with client.AsyncClient(http=http) as webproj:
+            results = await asyncio.gather(
+                *(
+                    webproj.transform("EPSG:4258", "EPSG:25832", (55.0, 9.0 + i / 100))
+                    for i in range(20)
+                )
+            )
+            assert (
+                await webproj.transform("EPSG:4258", "EPSG:25832", (55.0, 9.0))
+                == results[0]
+            )
+        return (results, requests)
+
+    (results, requests) = asyncio.run(run())
+    assert len(requests) == 1
+    assert len(results) == 20
+    assert abs(results[0]["v1"] - 500000.0) < 1e-6
+
+
+def test_cli():
+    """
+    Test that files transformed with the command line tool are identical to
+    the results of the API
+    """
+    coordinates = [[55.0 + i / 100, 9.0 + i / 50, float(i)] for i in range(100)]
+    expected = TestClient(app).post(
+        "/v1.2/trans/EPSG:4258/EPSG:25832", json=coordinates
+    )
+    expected = expected.json()
+
+    infile = io.StringIO("".join(json.dumps(c) + "\n" for c in coordinates))
+    outfile = io.StringIO()
+    stats = cli.transform_file(
+        "EPSG:4258",
+        "EPSG:25832",
+        infile,
+        outfile,
+        fmt="ndjson",
+        chunk_size=30,
+        workers=2,
+    )
+    assert stats["points"] == 100
+    assert [json.loads(line) for line in outfile.getvalue().splitlines()] == expected
+
+    infile = io.StringIO(
+        "lat;lon;h;name\n"
+        + "".join(f"{c[0]};{c[1]};{c[2]};p{i}\n" for i, c in enumerate(coordinates))
+    )
+    outfile = io.StringIO()
+    cli.transform_file(
+        "EPSG:4258",
+        "EPSG:25832",
+        infile,
+        outfile,
+        delimiter=";",
+        header=True,
+        workers=1,
+    )
+    lines = outfile.getvalue().splitlines()
+    assert lines[0] == "lat;lon;h;name"
+    for i, (line, coordinate) in enumerate(zip(lines[1:], expected)):
+        assert line.split(";") == [
+            repr(coordinate["v1"]),
+            repr(coordinate["v2"]),
+            repr(coordinate["v3"]),
+            f"p{i}",
+        ]
+
+    # numeric columns after the coordinate are not taken for coordinates
+    infile = io.StringIO(
+        "lat,lon,id\n"
+        + "".join(f"{c[0]},{c[1]},{i}\n" for i, c in enumerate(coordinates))
+    )
+    outfile = io.StringIO()
+    cli.transform_file(
+        "EPSG:4258", "EPSG:25832", infile, outfile, header=True, workers=1
+    )
+    lines = outfile.getvalue().splitlines()
+    assert [line.split(",")[2] for line in lines[1:3]] == ["0", "1"]
+
+    with pytest.raises(ValueError, match="dimension must be given"):
+        cli.transform_file(
+            "EPSG:4258", "EPSG:25832", io.StringIO("55.0,9.0,1\n"), io.StringIO()
+        )
+
+    infile = io.BytesIO(struct.pack(f"<{3 * len(coordinates)}d", *sum(coordinates, [])))
+    outfile = io.BytesIO()
+    cli.transform_file(
+        "EPSG:4258", "EPSG:25832", infile, outfile, fmt="binary", dimension=3, workers=1
+    )
+    values = struct.unpack(f"<{3 * len(coordinates)}d", outfile.getvalue())
+    assert list(values) == [c[v] for c in expected for v in ("v1", "v2", "v3")]
+
+
+def test_warm_up(tmp_path, monkeypatch):
+    """
+    Test that the grid warm-up reports grids and fails on broken pairs
+    """
+    assert api._warmup_pairs("EPSG:4258/EPSG:25832, epsg:4258/DK:S34J") == [
+        ("EPSG:4258", "EPSG:25832"),
+        ("EPSG:4258", "DK:S34J"),
+    ]
+    pairs = api._warmup_pairs("all")
+    assert ("EPSG:4258", "EPSG:25832") in pairs
+    assert ("EPSG:4326", "EPSG:3857") not in pairs
+    assert ("EPSG:4258", "EPSG:3184") not in pairs
+
+    report = api.warm_up([("EPSG:4258", "EPSG:25832")])
+    assert report["grids"] == []
+    assert report["errors"] == {}
+
+    with pytest.raises(RuntimeError, match="EPSG:4258/EPSG:0"):
+        api.warm_up([("EPSG:4258", "EPSG:0")])
+
+    grid = tmp_path / "test.tif"
+    grid.write_bytes(b"\0" * 3_000_000)
+    (size, load_time) = load_grid(grid, block_size=1024)
+    assert size == 3_000_000
+    assert load_time > 0
+
+    client = TestClient(app)
+    monkeypatch.setenv("WEBPROJ_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(api, "WARMUP_REPORT", report)
+    response = client.get("/admin/grids/", headers={"X-Admin-Token": "secret"})
+    assert response.json() == report
+
+
+def test_verify():
+    """
+    Test that the verification harness finds the fast paths identical to
+    the scalar path and detects deviations
+    """
+    reports = verify.verify_pair(
+        "EPSG:4258", "EPSG:25832", ["batch", "sharded"], n_points=200, seed=1
+    )
+    for report in reports:
+        assert report["points"] > 0
+        assert report["max_deviation"] == 0.0
+        assert report["identical"] == report["points"]
+        assert not verify.failed(report, tolerance=0.0)
+
+    # the source CRS's area of use doesn't overlap the destination's, so the
+    # points are sampled within the source's and must fail the same way
+    reports = verify.verify_pair(
+        "EPSG:23031", "EPSG:25833", ["batch", "fanout"], n_points=100, seed=1
+    )
+    for report in reports:
+        assert report["points"] > 0
+        assert not verify.failed(report, tolerance=0.0)
+    assert not verify.failed({"src": "A", "dst": "B", "skipped": "No area"}, 0.0)
+
+    reference = [(1.0, 2.0, None, None), "inf", (1.0, 2.0, None, None)]
+    report = verify.compare(reference, ([1.0, 1.0, 1.5], [2.0, 2.0, 2.0], None, None))
+    assert report["inf_mismatches"] == 1
+    assert report["max_deviation"] == 0.5
+    assert report["identical"] == 1
+    assert verify.failed(report, tolerance=1.0)
+
+    report = verify.compare(reference, ValueError("broken"))
+    assert report["error_mismatches"] == 3
@@ -0,0 +1,189 @@
+"""
+Admission control for incoming requests.
+
+Requests are grouped in route classes, each with a limit on the number of
+concurrent requests and on the number of requests waiting for a free slot.
+Requests that exceed both limits are rejected immediately with a
+503 Service Unavailable and a Retry-After header, instead of piling up in
+the server until clients time out.
+
+Limits are configured with environment variables. For a route class
+`<CLASS>` (CRS, TRANS or BATCH):
+
+    WEBPROJ_CONCURRENCY_<CLASS>   maximum number of concurrent requests
+    WEBPROJ_QUEUE_<CLASS>         maximum number of waiting requests
+
+A concurrency limit of 0 disables admission control for the route class.
+WEBPROJ_RETRY_AFTER sets the value of the Retry-After header in seconds.
+"""
+import asyncio
+import os
+import re
+from collections import deque
+
+from starlette.responses import JSONResponse
+
+# Default (concurrency, queue) limits per route class. CRS metadata is cheap
+# and unlimited, whereas batches are throttled hard to protect the rest.
+DEFAULT_LIMITS = {
+    "crs": (0, 0),
+    "trans": (64, 256),
+    "batch": (2, 8),
+}
+
+RETRY_AFTER = int(os.environ.get("WEBPROJ_RETRY_AFTER", 1))
+
+_CRS_PATH = re.compile(r"^/v1\.\d/(crs|info)(/|$)")
+_TRANS_PATH = re.compile(r"^/v1\.\d/trans/")
+_FANOUT_PATH = re.compile(r"^/v1\.\d/fanout/")
+
+
+def route_class(method, path):
+    """
+    Determine the route class of a request. Returns None for requests
+    that are not subject to admission control.
+    """
+    if _CRS_PATH.match(path):
+        return "crs"
+
+    if _TRANS_PATH.match(path):
+        if method == "POST":
+            return "batch"
+        return "trans"
+
+    if _FANOUT_PATH.match(path):
+        return "batch"
+
+    return None
+
+
+class Gate:
+    """
+    Concurrency limit with a bounded queue of waiting requests.
+
+    Gates are used from the event loop only and are therefore not
+    protected by locks.
+    """
+
+    def __init__(self, concurrency, queue_size):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self._waiters = deque()
+
+    @property
+    def queued(self):
+        """Number of requests waiting for a free slot"""
+        return len(self._waiters)
+
+    async def acquire(self):
+        """
+        Acquire a slot. Returns False if the request should be rejected.
+        """
+        if self.concurrency <= 0:
+            self.in_flight += 1
+            return True
+
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            return True
+
+        if len(self._waiters) >= self.queue_size:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just before cancellation
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+        return True
+
+    def release(self):
+        """
+        Release a slot, handing it directly to the next waiting request
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self.in_flight -= 1
+
+    def status(self):
+        """
+        Current limits and load of the gate
+        """
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+        }
+
+
+class AdmissionGates(dict):
+    """
+    Gates for each route class
+    """
+
+    @classmethod
+    def from_environ(cls):
+        """
+        Set up gates with limits read from the environment
+        """
+        gates = cls()
+        for name, (concurrency, queue_size) in DEFAULT_LIMITS.items():
+            gates[name] = Gate(
+                int(os.environ.get(f"WEBPROJ_CONCURRENCY_{name.upper()}", concurrency)),
+                int(os.environ.get(f"WEBPROJ_QUEUE_{name.upper()}", queue_size)),
+            )
+        return gates
+
+    def status(self):
+        """
+        Current limits and load of all gates
+        """
+        return {name: gate.status() for name, gate in self.items()}
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware that admits or rejects requests according to the
+    limits of their route class
+    """
+
+    def __init__(self, app, gates):
+        self.app = app
+        self.gates = gates
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        gate = self.gates.get(route_class(scope["method"], scope["path"]))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        if not await gate.acquire():
+            response = JSONResponse(
+                {"detail": "Server is busy. Try again later."},
+                status_code=503,
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
@@ -1,20 +1,42 @@
 from cmath import inf
+from math import isinf
 import os
+import copy
+import gzip
 import json
+import secrets
+import signal
+import threading
+import time
+import warnings
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 
 from fastapi import (
     FastAPI,
+    Header,
     HTTPException,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
     security,
     Depends,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import WebSocketRoute
 import pyproj
-from pyproj.transformer import Transformer, AreaOfInterest, CRS
+from pyproj.transformer import Transformer, TransformerGroup, AreaOfInterest, CRS
+
+from webproj.admission import AdmissionGates, AdmissionMiddleware
+from webproj.approx import METRES_PER_DEGREE, MIN_COVERAGE, Mesh
+from webproj.grids import find_grid, grids_in_definition, load_grid, snapshot
+from webproj.parallel import ShardedTransformer
+from webproj.profiler import ProfilerBusy, collapsed, profile
+from webproj.selection import ENABLED as FASTEST_PIPELINE, fastest_transformer
+from webproj.slowlog import TRACE, SlowRequestMiddleware
 
 __VERSION__ = "1.2.5"
 
@@ -60,6 +82,26 @@ def token_query_param(
     """
 
 
+def admin_access(
+    admin_token: Optional[str] = Depends(
+        security.api_key.APIKeyHeader(name="X-Admin-Token", auto_error=False)
+    ),
+):
+    """
+    Protect admin entry-points with the token in WEBPROJ_ADMIN_TOKEN
+
+    Admin entry-points are disabled when WEBPROJ_ADMIN_TOKEN is not set.
+    """
+    expected = os.environ.get("WEBPROJ_ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    if admin_token is None or not secrets.compare_digest(admin_token, expected):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid admin token"
+        )
+
+
 # Set up the app
 app = FastAPI(
     title="WEBPROJ",
@@ -77,20 +119,85 @@ app = FastAPI(
     docs_url="/documentation",
     dependencies=[Depends(token_header_param), Depends(token_query_param)],
 )
+ADMISSION = AdmissionGates.from_environ()
+app.add_middleware(AdmissionMiddleware, gates=ADMISSION)
+app.add_middleware(SlowRequestMiddleware)
+
 origins = ["*"]
 app.add_middleware(CORSMiddleware, allow_origins=origins)
 
 _DATA = Path(__file__).parent / Path("data.json")
 
+# Regions served by this instance, e.g. "DK" or "DK,GL". CRS's of other
+# regions are left out entirely, global CRS's are always served.
+if os.environ.get("WEBPROJ_REGIONS"):
+    REGIONS = {
+        region.strip().upper()
+        for region in os.environ["WEBPROJ_REGIONS"].split(",")
+        if region.strip()
+    }
+else:
+    REGIONS = None
+
+
+def _scope(registry):
+    """
+    Split the CRS registry in the CRS's served by this instance and the
+    regions of the CRS's that are not
+    """
+    if REGIONS is None:
+        return (registry, {})
+
+    unknown = REGIONS - {crsinfo["country"] for crsinfo in registry.values()}
+    if unknown:
+        raise ValueError(f"Unknown regions in WEBPROJ_REGIONS: {sorted(unknown)}")
+
+    served = {}
+    excluded = {}
+    for srid, crsinfo in registry.items():
+        if crsinfo["country"] == "Global" or crsinfo["country"] in REGIONS:
+            served[srid] = crsinfo
+        else:
+            excluded[srid] = crsinfo["country"]
+
+    return (served, excluded)
+
+
 with open(_DATA, "r", encoding="UTF-8") as data:
-    CRS_LIST = json.load(data)
+    (CRS_LIST, _EXCLUDED) = _scope(json.load(data))
     app.CRS_LIST = CRS_LIST
 
+# Unmodified copy of the served part of data.json and state of the PROJ
+# resource files, used to detect changes when reloading
+_REGISTRY = copy.deepcopy(CRS_LIST)
+_RESOURCES = snapshot()
+_RELOAD_LOCK = threading.Lock()
+
+# Rough estimate of the memory used by a PROJ object, excluding grids
+_PJ_MEMORY_ESTIMATE = 32 * 1024
+
 AOI = {
     "DK": AreaOfInterest(3.0, 54.5, 15.5, 58.0),
     "GL": AreaOfInterest(-75.0, 56.0, 8.5, 87.5),
 }
 
+# Transformation hub of each region
+HUBS = {
+    "DK": "EPSG:4258",
+    "GL": "EPSG:4909",
+}
+
+
+def _not_served(crs):
+    """
+    Error detail for CRS's of regions not served by this instance, or None
+    """
+    region = _EXCLUDED.get(crs.upper())
+    if region is None:
+        return None
+
+    return f"'{crs}' belongs to region {region}, which is not served by this instance"
+
 
 def _make_4d(coord):
     if len(coord) == 2:
@@ -105,6 +212,141 @@ def _make_4d(coord):
     return ()
 
 
+class LegFactory:
+    """
+    Cache of the legs that transformations are composed of.
+
+    Legs are shared by all transformations that pass through them, e.g.
+    every transformation from DK:S34J starts with the same leg from DK:S34J
+    to ETRS89 and every transformation from EPSG:25832 to a DK:* system
+    uses the same leg from EPSG:25832 to ETRS89.
+    """
+
+    legs = {}
+
+    # Benchmarks of candidate operations for legs where the fastest
+    # operation is selected, keyed by leg
+    selections = {}
+
+    @classmethod
+    def from_pipeline(cls, pipeline: str):
+        legs = cls.legs
+        if pipeline not in legs:
+            legs[pipeline] = Transformer.from_pipeline(pipeline)
+
+        return legs[pipeline]
+
+    @classmethod
+    def from_crs(cls, src: str, dst: str, region: str):
+        legs = cls.legs
+        key = (src, dst, region)
+        if key not in legs:
+            # Explicit promotion to 3D CRS's to ensure vertical
+            # transformations are picked up correctly.
+            # Tested in test_conversion_to_3d().
+            crs_from = CRS(src).to_3d()
+            crs_to = CRS(dst).to_3d()
+
+            fastest = None
+            if FASTEST_PIPELINE:
+                (fastest, selection) = fastest_transformer(
+                    crs_from, crs_to, AOI[region]
+                )
+                if selection is not None:
+                    cls.selections[key] = selection
+
+            if fastest is None:
+                fastest = Transformer.from_crs(
+                    crs_from=crs_from,
+                    crs_to=crs_to,
+                    area_of_interest=AOI[region],
+                )
+            legs[key] = fastest
+
+        return legs[key]
+
+    @staticmethod
+    def _resources(key):
+        """
+        Names of the PROJ resource files (init files and grids) a leg
+        depends on, including grids of candidate operations not in use
+        """
+        if isinstance(key, str):
+            names = set(grids_in_definition(key))
+            for token in key.split():
+                if token.startswith("+init="):
+                    names.add(token[len("+init=") :].split(":")[0])
+            return names
+
+        (src, dst, region) = key
+        with warnings.catch_warnings():
+            # warns when the best operation is unavailable due to missing grids
+            warnings.simplefilter("ignore")
+            group = TransformerGroup(
+                CRS(src).to_3d(), CRS(dst).to_3d(), area_of_interest=AOI[region]
+            )
+
+        names = set()
+        for transformer in group.transformers:
+            names.update(grids_in_definition(transformer.definition))
+        for operation in group.unavailable_operations:
+            names.update(grid.short_name for grid in operation.grids)
+
+        return names
+
+    @staticmethod
+    def grids(key):
+        """
+        Grids a leg from CRS to CRS may use, and grids that are missing for
+        the operation PROJ would prefer if all grids were available
+        """
+        (src, dst, region) = key
+        with warnings.catch_warnings():
+            # warns when the best operation is unavailable due to missing grids
+            warnings.simplefilter("ignore")
+            group = TransformerGroup(
+                CRS(src).to_3d(), CRS(dst).to_3d(), area_of_interest=AOI[region]
+            )
+
+        used = set()
+        for transformer in group.transformers:
+            used.update(grids_in_definition(transformer.definition, optional=False))
+
+        missing = set()
+        if not group.best_available and group.unavailable_operations:
+            (best, *_) = group.unavailable_operations
+            missing.update(grid.short_name for grid in best.grids if not grid.available)
+
+        return (used, missing)
+
+    @classmethod
+    def invalidate(cls, srids, resources):
+        """
+        Drop legs that involve any of the CRS's in `srids` or depend on any
+        of the resource files in `resources`. Returns the dropped legs.
+        """
+        legs = {}
+        dropped = []
+        # iterates over a copy, as requests add legs concurrently
+        for key, leg in list(cls.legs.items()):
+            if isinstance(key, str):
+                affected = any(f"+init={srid}" in key.split() for srid in srids)
+            else:
+                affected = key[0] in srids or key[1] in srids
+
+            if not affected and resources:
+                affected = not cls._resources(key).isdisjoint(resources)
+
+            if affected:
+                dropped.append(leg)
+                cls.selections.pop(key, None)
+            else:
+                legs[key] = leg
+
+        cls.legs = legs
+        return dropped
+
+
 class OptimusPrime:
     """
     Optimus Prime is a Transformer... also, this is fun and avoids
@@ -115,8 +357,10 @@ class OptimusPrime:
         """
         Transformation from src to dst
         """
+        start = time.perf_counter()
         self.pre_pipeline = None
         self.epsg_pipeline = None
+        self.epsg_leg = None
         self.post_pipeline = None
 
         src = src.upper()
@@ -126,13 +370,14 @@ class OptimusPrime:
         if src not in CRS_LIST.keys():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Unknown source CRS identifier: '{src}'",
+                detail=_not_served(src) or f"Unknown source CRS identifier: '{src}'",
             )
 
         if dst not in CRS_LIST.keys():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Unknown destination CRS identifier: '{dst}'",
+                detail=_not_served(dst)
+                or f"Unknown destination CRS identifier: '{dst}'",
             )
 
         src_region = CRS_LIST[src]["country"]
@@ -145,11 +390,11 @@ class OptimusPrime:
 
         # determine region of transformation
         if src_region == dst_region:
-            region = AOI[src_region]
+            region = src_region
         elif src_region == "Global":
-            region = AOI[dst_region]
+            region = dst_region
         else:
-            region = AOI[src_region]
+            region = src_region
 
         src_auth = src.split(":")[0]
         dst_auth = dst.split(":")[0]
@@ -165,7 +410,7 @@ class OptimusPrime:
                 f"+step +proj=unitconvert +xy_in=rad +xy_out=deg "
                 f"+step +proj=axisswap +order=2,1"
             )
-            self.pre_pipeline = Transformer.from_pipeline(pipeline)
+            self.pre_pipeline = LegFactory.from_pipeline(pipeline)
 
             if src_auth == "DK":
                 src = "EPSG:4258"
@@ -181,14 +426,8 @@ class OptimusPrime:
                 dst_hub = "EPSG:4909"
 
             try:
-                # Explicit promotion to 3D CRS's to ensure vertical
-                # transformations are picked up correctly.
-                # Tested in test_conversion_to_3d().
-                self.epsg_pipeline = Transformer.from_crs(
-                    crs_from=CRS(src).to_3d(),
-                    crs_to=CRS(dst_hub).to_3d(),
-                    area_of_interest=region,
-                )
+                self.epsg_leg = (src, dst_hub, region)
+                self.epsg_pipeline = LegFactory.from_crs(*self.epsg_leg)
             except RuntimeError as error:
                 raise ValueError("Invalid CRS identifier") from error
 
@@ -199,24 +438,74 @@ class OptimusPrime:
                 f"+step +proj=unitconvert +xy_in=deg +xy_out=rad "
                 f"+step +init={dst}"
             )
-            self.post_pipeline = Transformer.from_pipeline(pipeline)
+            self.post_pipeline = LegFactory.from_pipeline(pipeline)
+
+        self.construction_time = time.perf_counter() - start
+        self.created = time.time()
+        self.last_used = self.created
+        self.hits = 0
+
+    def stages(self):
+        """
+        The pre, epsg and post pipelines that are in use
+        """
+        stages = {
+            "pre": self.pre_pipeline,
+            "epsg": self.epsg_pipeline,
+            "post": self.post_pipeline,
+        }
+        return {name: pipeline for name, pipeline in stages.items() if pipeline}
+
+    def describe(self):
+        """
+        Describe the pipelines, grids and usage of the transformation
+        """
+        stages = {}
+        memory = 0
+        for name, pipeline in self.stages().items():
+            grids = []
+            for grid in grids_in_definition(pipeline.definition):
+                path = find_grid(grid)
+                size = os.path.getsize(path) if path else None
+                grids.append({"name": grid, "path": path, "size": size})
+                memory += size or 0
+
+            stages[name] = {
+                "definition": pipeline.definition,
+                "description": pipeline.description,
+                "accuracy": pipeline.accuracy,
+                "grids": grids,
+                "selection": (
+                    LegFactory.selections.get(self.epsg_leg) if name == "epsg" else None
+                ),
+            }
+            memory += _PJ_MEMORY_ESTIMATE
+
+        return {
+            "stages": stages,
+            "construction_time": self.construction_time,
+            "created": self.created,
+            "hits": self.hits,
+            "last_used": self.last_used,
+            "memory_estimate": memory,
+        }
 
     def transform(self, coord):
         """
         Transform coordinate
         """
-        (v1, v2, v3, v4) = coord
-        if self.pre_pipeline:
-            out = self.pre_pipeline.transform(v1, v2, v3, v4)
-            (v1, v2, v3, v4) = _make_4d(out)
-
-        if self.epsg_pipeline:
-            out = self.epsg_pipeline.transform(v1, v2, v3, v4)
-            (v1, v2, v3, v4) = _make_4d(out)
+        trace = TRACE.get()
+        if trace is not None:
+            trace.dimension = sum(v is not None for v in coord)
+            trace.points = 1
 
-        if self.post_pipeline:
-            out = self.post_pipeline.transform(v1, v2, v3, v4)
+        (v1, v2, v3, v4) = coord
+        for name, pipeline in self.stages().items():
+            start = time.perf_counter()
+            out = pipeline.transform(v1, v2, v3, v4)
             (v1, v2, v3, v4) = _make_4d(out)
+            if trace is not None:
+                trace.add_stage(name, time.perf_counter() - start)
 
         if float("inf") in out or float("-inf") in out:
             raise HTTPException(
@@ -226,20 +515,251 @@ class OptimusPrime:
 
         return (v1, v2, v3, v4)
 
+    def transform_batch(self, columns):
+        """
+        Transform a batch of coordinates given as columns of v1, v2, v3
+        and v4 values. Columns of unused coordinate components are None.
+
+        Points that are outside the area of use are returned as inf.
+        """
+        trace = TRACE.get()
+        if trace is not None:
+            trace.dimension = len(columns)
+            trace.points = len(columns[0])
+
+        (v1, v2, v3, v4) = _make_4d(columns)
+        for name, pipeline in self.stages().items():
+            start = time.perf_counter()
+            out = pipeline.transform(v1, v2, v3, v4)
+            (v1, v2, v3, v4) = _make_4d(out)
+            if trace is not None:
+                trace.add_stage(name, time.perf_counter() - start)
+
+        return (v1, v2, v3, v4)
+
 
 class TransformerFactory:
     transformers = {}
 
     @classmethod
     def create(cls, src: str, dst: str):
-        if src not in cls.transformers.keys():
-            cls.transformers[src] = {}
+        transformers = cls.transformers.setdefault(src, {})
+        miss = dst not in transformers.keys()
+
+        trace = TRACE.get()
+        if trace is not None:
+            trace.add_transformer(src.upper(), dst.upper(), miss)
 
-        if dst not in cls.transformers[src].keys():
-            cls.transformers[src][dst] = OptimusPrime(src, dst)
+        if miss:
+            transformers[dst] = OptimusPrime(src, dst)
+            if trace is not None:
+                trace.add_stage("construct", transformers[dst].construction_time)
 
-        return cls.transformers[src][dst]
+        transformer = transformers[dst]
+        transformer.hits += 1
+        transformer.last_used = time.time()
 
+        return transformer
+
+    @classmethod
+    def invalidate(cls, srids, legs):
+        """
+        Drop transformers from or to any of the CRS's in `srids` and
+        transformers that use any of the given legs. Returns the (src, dst)
+        pairs of the dropped transformers.
+        """
+        cached = {}
+        dropped = set()
+        # iterates over copies, as requests add transformers concurrently
+        for src, transformers in list(cls.transformers.items()):
+            cached[src] = {}
+            for dst, transformer in list(transformers.items()):
+                uses_leg = any(
+                    stage is leg
+                    for stage in transformer.stages().values()
+                    for leg in legs
+                )
+                if src.upper() in srids or dst.upper() in srids or uses_leg:
+                    dropped.add((src.upper(), dst.upper()))
+                else:
+                    cached[src][dst] = transformer
+
+        cls.transformers = cached
+        return dropped
+
+    @classmethod
+    def describe(cls):
+        """
+        Describe all cached transformers
+        """
+        return [
+            {"src": src, "dst": dst, **transformer.describe()}
+            for src, transformers in list(cls.transformers.items())
+            for dst, transformer in list(transformers.items())
+        ]
+
+
+def _area_of_use(src: str, dst: str, source_only: bool = False):
+    """
+    Region and (west, south, east, north) bounds of the area where a
+    transformation is used: the area of interest of the region limited to
+    the bounding boxes of the CRS's, or only to that of src if
+    `source_only` is True. None if the area is empty.
+    """
+    region = CRS_LIST[src]["country"]
+    if region == "Global":
+        region = CRS_LIST[dst]["country"]
+    if region not in HUBS:
+        return None
+
+    aoi = AOI[region]
+    (west, south, east, north) = (
+        aoi.west_lon_degree,
+        aoi.south_lat_degree,
+        aoi.east_lon_degree,
+        aoi.north_lat_degree,
+    )
+    for crs in (src,) if source_only else (src, dst):
+        crsinfo = crs_v1_1(crs)
+        if isinstance(crsinfo, HTTPException):
+            return None
+        (bbox_west, bbox_south, bbox_east, bbox_north) = crsinfo["bounding_box"]
+        west = max(west, bbox_west)
+        south = max(south, bbox_south)
+        east = min(east, bbox_east)
+        north = min(north, bbox_north)
+
+    if west >= east or south >= north:
+        return None
+
+    return (region, (west, south, east, north))
+
+
+class MeshFactory:
+    """
+    Cache of interpolation meshes used for approximate transformations
+    """
+
+    meshes = {}
+    # pairs with a mesh being built, and an event set when it is done
+    _building = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def create(cls, src: str, dst: str, wait: bool = True):
+        """
+        Return the mesh from src to dst, or None if the transformation
+        can't be approximated. A mesh is only built once, other callers
+        wait for it. With `wait=False` the mesh is built in the background
+        and None is returned until it is ready.
+        """
+        key = (src.upper(), dst.upper())
+        with cls._lock:
+            if key in cls.meshes:
+                return cls.meshes[key]
+            done = cls._building.get(key)
+            build = done is None
+            if build:
+                done = cls._building[key] = threading.Event()
+
+        if not wait:
+            if build:
+                threading.Thread(
+                    target=cls._build_in_background,
+                    args=(key, done),
+                    name="webproj-mesh",
+                    daemon=True,
+                ).start()
+            return None
+
+        if build:
+            cls._run(key, done)
+        else:
+            done.wait()
+        return cls.meshes.get(key)
+
+    @classmethod
+    def _run(cls, key, done):
+        mesh = None
+        try:
+            mesh = cls._build(*key)
+        finally:
+            with cls._lock:
+                # a reload during the build has dropped the pair
+                if cls._building.get(key) is done:
+                    cls.meshes[key] = mesh
+                    del cls._building[key]
+            done.set()
+
+    @classmethod
+    def _build_in_background(cls, key, done):
+        try:
+            cls._run(key, done)
+        except Exception:  # pylint: disable=broad-except
+            # the pair is transformed exactly
+            pass
+
+    @classmethod
+    def invalidate(cls, srids, pairs):
+        """
+        Drop meshes from or to any of the CRS's in `srids` and meshes built
+        with the transformers of any of the (src, dst) `pairs`. Returns the
+        number of dropped meshes.
+        """
+        def affected(src, dst):
+            # a mesh is built with the transformer from src to dst and
+            # the transformer from the hub to src
+            used = {(src, dst)} | {(hub, src) for hub in HUBS.values()}
+            return src in srids or dst in srids or bool(used & pairs)
+
+        with cls._lock:
+            meshes = {
+                key: mesh for key, mesh in cls.meshes.items() if not affected(*key)
+            }
+            dropped = len(cls.meshes) - len(meshes)
+            cls.meshes = meshes
+            cls._building = {
+                key: done
+                for key, done in cls._building.items()
+                if not affected(*key)
+            }
+
+        return dropped
+
+    @staticmethod
+    def _build(src: str, dst: str):
+        # validates the CRS's before anything else
+        transformer = TransformerFactory.create(src, dst)
+
+        area = _area_of_use(src, dst)
+        if area is None:
+            return None
+        (region, (west, south, east, north)) = area
+
+        # Find the bounds of the area in source coordinates by transforming
+        # its densified outline from the hub, which has latitude first
+        outline = _densify(
+            [(south, west), (south, east), (north, east), (north, west)], 50
+        )
+        to_src = TransformerFactory.create(HUBS[region], src)
+        (v1, v2, _, _) = to_src.transform_batch(tuple(zip(*outline)))
+        points = [(x, y) for (x, y) in zip(v1, v2) if not (isinf(x) or isinf(y))]
+        if not points:
+            return None
+        (xs, ys) = zip(*points)
+
+        crsinfo = crs_v1_2(dst)
+        scale = METRES_PER_DEGREE if crsinfo["v1_unit"] == "degree" else 1.0
+
+        mesh = Mesh(transformer, (min(xs), min(ys), max(xs), max(ys)), scale=scale)
+
+        # the exact transformation is used if the mesh doesn't pay off
+        if mesh.coverage < MIN_COVERAGE or mesh.speedup() <= 1.0:
+            return None
+        return mesh
+
+
+SHARDED_TRANSFORMER = ShardedTransformer(create=TransformerFactory.create)
 
 # Set up return types
 
@@ -247,9 +767,10 @@ class TransformerFactory:
 class CRSList(BaseModel):
     """Return response for List of CRS's"""
 
-    DK: List[str]
-    GL: List[str]
-    Global: List[str]
+    # regions not served by the instance are empty
+    DK: List[str] = []
+    GL: List[str] = []
+    Global: List[str] = []
 
 
 class CRS_1_0(BaseModel):  # pylint: disable=invalid-name
@@ -294,12 +815,127 @@ class Coordinate(BaseModel):
     v4: float | None
 
 
+class BoundsInput(BaseModel):
+    """Input for transformation of a bounding box or ring"""
+
+    bbox: Tuple[float, float, float, float] | None = None
+    ring: List[Tuple[float, float]] | None = None
+    densify: int = 21
+
+
+class Bounds(BaseModel):
+    """Return response of a transformed bounding box or ring"""
+
+    bbox: Tuple[float, float, float, float]
+    ring: List[Tuple[float, float]]
+
+
+class FanoutInput(BaseModel):
+    """Input for transformation from one CRS to many"""
+
+    coordinates: List[List[float]]
+    targets: List[str] | None = None
+
+
+class FanoutResult(BaseModel):
+    """Return response of a transformation to one of many CRS's"""
+
+    coordinates: List[Coordinate | None] | None = None
+    detail: str | None = None
+
+
 class HTTPError(BaseModel):
     """Return response in case of an error"""
 
     detail: str
 
 
+class GateStatus(BaseModel):
+    """Return response for the load of a route class"""
+
+    concurrency: int
+    queue_size: int
+    in_flight: int
+    queued: int
+
+
+class Grid(BaseModel):
+    """Return response for a grid used by a pipeline"""
+
+    name: str
+    path: str | None
+    size: int | None
+
+
+class Candidate(BaseModel):
+    """Return response for a benchmarked candidate operation"""
+
+    description: str
+    accuracy: float
+    time: float
+
+
+class Selection(BaseModel):
+    """Return response for the selection of the fastest operation"""
+
+    selected: str
+    candidates: List[Candidate]
+
+
+class PipelineStage(BaseModel):
+    """Return response for a stage of a transformation"""
+
+    definition: str
+    description: str
+    accuracy: float
+    grids: List[Grid]
+    selection: Selection | None
+
+
+class CachedTransformer(BaseModel):
+    """Return response for a cached transformer"""
+
+    src: str
+    dst: str
+    stages: Dict[str, PipelineStage]
+    construction_time: float
+    created: float
+    hits: int
+    last_used: float
+    memory_estimate: int
+
+
+class GridResidency(BaseModel):
+    """Return response for a grid loaded at startup"""
+
+    name: str
+    path: str | None
+    size: int | None
+    load_time: float | None
+    missing: bool
+    pairs: List[str]
+
+
+class WarmupReport(BaseModel):
+    """Return response for the grid warm-up at startup"""
+
+    grids: List[GridResidency]
+    errors: Dict[str, str]
+    time: float
+
+
+class ReloadReport(BaseModel):
+    """Return response for a reload of the CRS registry"""
+
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+    resources: List[str]
+    invalidated_legs: int
+    invalidated_transformers: int
+    invalidated_meshes: int
+
+
 class WEBPROJInfo(BaseModel):
     """Return response for WEBPROJ info"""
 
@@ -346,7 +982,8 @@ def crs_v1_0(crs):
         return CRS_LIST[crs.upper()]
     except KeyError:
         return HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{crs}' not available."
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=_not_served(crs) or f"'{crs}' not available.",
         )
 
 
@@ -452,6 +1089,442 @@ def crs_v1_2(crs):
     return dict(sorted(output.items()))
 
 
+def reload_registry():
+    """
+    Re-read data.json and check the PROJ resource files for changes.
+
+    Only the CRS info, catalogues, legs, transformers and meshes affected by
+    the changes are dropped. Everything else stays cached.
+    """
+    global CRS_LIST, _EXCLUDED, _REGISTRY, _RESOURCES  # pylint: disable=global-statement
+
+    with _RELOAD_LOCK:
+        with open(_DATA, "r", encoding="UTF-8") as data:
+            (registry, excluded) = _scope(json.load(data))
+        resources = snapshot()
+
+        changed = {
+            srid
+            for srid in registry.keys() | _REGISTRY.keys()
+            if registry.get(srid) != _REGISTRY.get(srid)
+        }
+        changed_resources = {
+            name
+            for name in resources.keys() | _RESOURCES.keys()
+            if resources.get(name) != _RESOURCES.get(name)
+        }
+
+        # Replace the CRS list as a whole, so requests in flight see either
+        # the old or the new list. Unchanged entries are kept as they are.
+        crs_list = {
+            srid: CRS_LIST[srid] if srid not in changed else copy.deepcopy(crsinfo)
+            for srid, crsinfo in registry.items()
+        }
+        countries = {
+            crsinfo["country"]
+            for srid in changed
+            for crsinfo in (registry.get(srid), _REGISTRY.get(srid))
+            if crsinfo is not None
+        }
+        report = {
+            "added": sorted(registry.keys() - _REGISTRY.keys()),
+            "removed": sorted(_REGISTRY.keys() - registry.keys()),
+            "changed": sorted(changed & registry.keys() & _REGISTRY.keys()),
+            "resources": sorted(changed_resources),
+        }
+
+        CRS_LIST = crs_list
+        app.CRS_LIST = crs_list
+        _EXCLUDED = excluded
+
+        if changed:
+            for country in countries | {None}:
+                _CATALOGUES.pop(country, None)
+
+        legs = LegFactory.invalidate(changed, changed_resources)
+        report["invalidated_legs"] = len(legs)
+        pairs = TransformerFactory.invalidate(changed, legs)
+        report["invalidated_transformers"] = len(pairs)
+        report["invalidated_meshes"] = MeshFactory.invalidate(changed, pairs)
+
+        # The state changes are detected against is only updated once
+        # everything affected is dropped, so a failed reload is redone
+        # in full by the next one
+        _REGISTRY = registry
+        _RESOURCES = resources
+
+    return report
+
+
+def _reload_on_signal(signum, frame):
+    """
+    Reload the registry in the background when receiving a signal
+    """
+    threading.Thread(target=reload_registry, daemon=True).start()
+
+
+if "WEBPROJ_RELOAD_SIGNAL" in os.environ:
+    signal.signal(
+        getattr(signal, os.environ["WEBPROJ_RELOAD_SIGNAL"]), _reload_on_signal
+    )
+
+
+def compatible_pairs():
+    """
+    All pairs of different CRS's that can be transformed between
+    """
+    pairs = []
+    for src, src_info in CRS_LIST.items():
+        for dst, dst_info in CRS_LIST.items():
+            regions = {src_info["country"], dst_info["country"]}
+            # global CRS's are compatible with regional CRS's only
+            if src == dst or regions == {"Global"}:
+                continue
+            if len(regions) == 1 or "Global" in regions:
+                pairs.append((src, dst))
+
+    return pairs
+
+
+def _warmup_pairs(spec):
+    """
+    Parse a list of CRS pairs written as SRC/DST and separated by commas or
+    whitespace. "all" gives all pairs of compatible CRS's.
+    """
+    if spec.strip().lower() == "all":
+        return compatible_pairs()
+
+    pairs = []
+    for pair in spec.replace(",", " ").split():
+        (src, _, dst) = pair.partition("/")
+        if not src or not dst:
+            raise ValueError(f"Invalid CRS pair in WEBPROJ_WARMUP: '{pair}'")
+        pairs.append((src.upper(), dst.upper()))
+
+    return pairs
+
+
+def warm_up(pairs):
+    """
+    Build the transformers of the given (src, dst) pairs and read the grids
+    they use, so the first requests don't pay for loading them.
+
+    Returns a report of the grids with their size, load time and whether
+    they are missing. Raises RuntimeError if grids are missing or a
+    transformer can't be built, as transformations would otherwise silently
+    fall back to less accurate operations or return inf.
+    """
+    start = time.perf_counter()
+    grids = {}
+    errors = {}
+    for src, dst in pairs:
+        pair = f"{src}/{dst}"
+        try:
+            transformer = TransformerFactory.create(src, dst)
+        except HTTPException as error:
+            errors[pair] = error.detail
+            continue
+        except pyproj.exceptions.ProjError as error:
+            errors[pair] = str(error)
+            continue
+
+        used = set()
+        missing = set()
+        for name, pipeline in transformer.stages().items():
+            if name == "epsg" and transformer.epsg_leg is not None:
+                (leg_used, leg_missing) = LegFactory.grids(transformer.epsg_leg)
+                used |= leg_used
+                missing |= leg_missing
+            used.update(grids_in_definition(pipeline.definition, optional=False))
+
+        for grid in sorted(used | missing):
+            entry = grids.setdefault(
+                grid,
+                {
+                    "name": grid,
+                    "path": None,
+                    "size": None,
+                    "load_time": None,
+                    "missing": False,
+                    "pairs": [],
+                },
+            )
+            entry["missing"] = entry["missing"] or grid in missing
+            entry["pairs"].append(pair)
+
+    for entry in grids.values():
+        entry["path"] = find_grid(entry["name"])
+        if entry["path"] is None:
+            entry["missing"] = True
+        else:
+            (entry["size"], entry["load_time"]) = load_grid(entry["path"])
+
+    report = {
+        "grids": sorted(grids.values(), key=lambda entry: entry["name"]),
+        "errors": errors,
+        "time": time.perf_counter() - start,
+    }
+
+    missing = [entry["name"] for entry in report["grids"] if entry["missing"]]
+    if missing or errors:
+        raise RuntimeError(
+            f"Grid warm-up failed. Missing grids: {missing}. Failed pairs: {errors}"
+        )
+
+    return report
+
+
+# Report of the grid warm-up at startup
+WARMUP_REPORT = {"grids": [], "errors": {}, "time": 0.0}
+
+if "WEBPROJ_WARMUP" in os.environ:
+    WARMUP_REPORT = warm_up(_warmup_pairs(os.environ["WEBPROJ_WARMUP"]))
+
+
+# Pre-serialized and gzip compressed catalogues, keyed by country
+_CATALOGUES = {}
+
+
+def _catalogue(country: Optional[str] = None):
+    """
+    Build the v1.2 CRS info of all CRS's, or those of a single country, as
+    serialized JSON in both plain and gzip compressed form.
+    """
+    if country not in _CATALOGUES:
+        catalogue = {}
+        for srid, crsinfo in CRS_LIST.items():
+            if country is not None and crsinfo["country"] != country:
+                continue
+            output = crs_v1_2(srid)
+            if not isinstance(output, HTTPException):
+                catalogue[srid] = output
+
+        # serialize the same way as FastAPI's JSONResponse
+        body = json.dumps(
+            catalogue, ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        _CATALOGUES[country] = (body, gzip.compress(body))
+
+    return _CATALOGUES[country]
+
+
+@app.get(
+    "/v1.2/catalogue/",
+    responses={
+        status.HTTP_200_OK: {"model": Dict[str, CRS_1_2]},
+        status.HTTP_400_BAD_REQUEST: {"model": HTTPError},
+    },
+)
+@app.get("/v1.2/catalogue", include_in_schema=False)
+def catalogue(
+    country: Optional[str] = None, accept_encoding: Optional[str] = Header(None)
+):
+    """
+    Retrieve information about all available coordinate reference systems
+
+    The information of each CRS is the same as returned by `/v1.2/crs/{crs}`.
+    Use `country` to only include the CRS's of a given country, e.g. `DK`.
+    """
+    countries = {crsinfo["country"] for crsinfo in CRS_LIST.values()}
+    if country is not None and country not in countries:
+        if country in _EXCLUDED.values():
+            detail = f"Country '{country}' is not served by this instance"
+        else:
+            detail = f"Unknown country: '{country}'"
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
+
+    (body, compressed) = _catalogue(country)
+    if accept_encoding and "gzip" in accept_encoding:
+        return Response(
+            content=compressed,
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
+        )
+
+    return Response(
+        content=body, media_type="application/json", headers={"Vary": "Accept-Encoding"}
+    )
+
+
+# Upper limit of points added along each edge of a bounding box or ring
+MAX_DENSIFY = 1000
+
+# Upper limit of points in a densified ring
+MAX_BOUNDS_POINTS = 100000
+
+
+def _densify(ring, densify):
+    """
+    Add `densify` equally spaced points along each edge of a ring. The ring
+    is closed by an edge from the last to the first vertex.
+    """
+    points = []
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        for i in range(densify + 1):
+            fraction = i / (densify + 1)
+            points.append((x0 + (x1 - x0) * fraction, y0 + (y1 - y0) * fraction))
+
+    return points
+
+
+def _clip(vertices, axis, limit, keep_above):
+    """
+    Clip a ring of (lon, lat, point) vertices to one side of a line of
+    constant longitude (axis 0) or latitude (axis 1). Vertices added on the
+    line have no point in source coordinates.
+    """
+    clipped = []
+    for a, b in zip(vertices, vertices[1:] + vertices[:1]):
+        a_inside = (a[axis] >= limit) == keep_above
+        b_inside = (b[axis] >= limit) == keep_above
+        if a_inside:
+            clipped.append(a)
+        if a_inside != b_inside and a[axis] != b[axis]:
+            fraction = (limit - a[axis]) / (b[axis] - a[axis])
+            vertex = [None, None, None]
+            vertex[axis] = limit
+            vertex[1 - axis] = a[1 - axis] + (b[1 - axis] - a[1 - axis]) * fraction
+            clipped.append(tuple(vertex))
+
+    return clipped
+
+
+def _clip_to_area(src, dst, points, densify):
+    """
+    Clip a densified ring in source coordinates to the area of use of the
+    transformation from src to dst. Edges added along the border of the
+    area are densified with `densify` points. Returns the clipped ring,
+    which is empty if the ring is entirely outside the area.
+    """
+    area = _area_of_use(src, dst)
+    if area is None:
+        return []
+    (region, (west, south, east, north)) = area
+
+    # the hubs are geographic with latitude first
+    to_hub = TransformerFactory.create(src, HUBS[region])
+    (lats, lons, _, _) = to_hub.transform_batch(tuple(zip(*points)))
+    vertices = [
+        (lon, lat, point)
+        for (lon, lat, point) in zip(lons, lats, points)
+        if not (isinf(lon) or isinf(lat))
+    ]
+    if len(vertices) == len(points) and all(
+        west <= lon <= east and south <= lat <= north for (lon, lat, _) in vertices
+    ):
+        return points
+
+    for axis, limit, keep_above in (
+        (0, west, True),
+        (0, east, False),
+        (1, south, True),
+        (1, north, False),
+    ):
+        vertices = _clip(vertices, axis, limit, keep_above)
+        if not vertices:
+            return []
+
+    ring = []
+    for a, b in zip(vertices, vertices[1:] + vertices[:1]):
+        ring.append(a)
+        if a[2] is None and b[2] is None:
+            for i in range(1, densify + 1):
+                fraction = i / (densify + 1)
+                ring.append(
+                    (
+                        a[0] + (b[0] - a[0]) * fraction,
+                        a[1] + (b[1] - a[1]) * fraction,
+                        None,
+                    )
+                )
+
+    # vertices on the border of the area are transformed back to src
+    added = [(lat, lon) for (lon, lat, point) in ring if point is None]
+    if added:
+        to_src = TransformerFactory.create(HUBS[region], src)
+        (v1, v2, _, _) = to_src.transform_batch(tuple(zip(*added)))
+        added = iter(zip(v1, v2))
+
+    return [point if point is not None else next(added) for (_, _, point) in ring]
+
+
+@app.post(
+    "/v1.2/trans/{src}/{dst}/bounds",
+    responses={
+        status.HTTP_200_OK: {"model": Bounds},
+        status.HTTP_400_BAD_REQUEST: {"model": HTTPError},
+        status.HTTP_404_NOT_FOUND: {"model": HTTPError},
+    },
+)
+def transformation_bounds(src: str, dst: str, bounds: BoundsInput):
+    """
+    Transform a bounding box or ring from one CRS to another
+
+    Give either `bbox` as `[v1_min, v2_min, v1_max, v2_max]` or `ring` as a
+    list of `[v1, v2]` vertices. Each edge is densified with `densify` points
+    before transformation, so that curved edges are represented in the
+    result. The ring is clipped to the area of use of the transformation,
+    i.e. the bounding boxes of the CRS's within the region.
+
+    The response holds the bounding box of the transformed points and the
+    transformed, densified ring.
+    """
+    if (bounds.bbox is None) == (bounds.ring is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either bbox or ring must be given",
+        )
+
+    if not 0 <= bounds.densify <= MAX_DENSIFY:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"densify must be between 0 and {MAX_DENSIFY}",
+        )
+
+    if bounds.bbox is not None:
+        (v1_min, v2_min, v1_max, v2_max) = bounds.bbox
+        ring = [(v1_min, v2_min), (v1_max, v2_min), (v1_max, v2_max), (v1_min, v2_max)]
+    else:
+        ring = [tuple(vertex) for vertex in bounds.ring]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        if len(ring) < 3:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="A ring must have at least three vertices",
+            )
+
+    if len(ring) * (bounds.densify + 1) > MAX_BOUNDS_POINTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The densified ring can hold at most {MAX_BOUNDS_POINTS} points",
+        )
+
+    points = _densify(ring, bounds.densify)
+    try:
+        transformer = TransformerFactory.create(src, dst)
+        points = _clip_to_area(src, dst, points, bounds.densify)
+        if points:
+            (v1, v2, _, _) = transformer.transform_batch(tuple(zip(*points)))
+        else:
+            (v1, v2) = ([], [])
+    except ValueError as error:
+        return HTTPException(status_code=404, detail=error)
+
+    out = [(x, y) for (x, y) in zip(v1, v2) if not (isinf(x) or isinf(y))]
+    if not out:
+        raise HTTPException(
+            status_code=404,
+            detail="Input coordinate outside area of use of either source or destination CRS",
+        )
+
+    (xs, ys) = zip(*out)
+    return {
+        "bbox": (min(xs), min(ys), max(xs), max(ys)),
+        "ring": out + out[:1],
+    }
+
+
 @app.get("/v1.0/trans/{src}/{dst}/{v}")
 @app.get("/v1.1/trans/{src}/{dst}/{v}")
 @app.get("/v1.2/trans/{src}/{dst}/{v}")
@@ -514,6 +1587,291 @@ async def transformation_4d(
     return {"v1": v1, "v2": v2, "v3": v3, "v4": v4}
 
 
+def _columns(coordinates):
+    """
+    Split a list of coordinates in columns of v1, v2, v3 and v4 values
+    """
+    dimension = len(coordinates[0])
+    if dimension not in (2, 3, 4) or any(len(c) != dimension for c in coordinates):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Coordinates must all be either 2D, 3D or 4D",
+        )
+
+    return tuple(list(column) for column in zip(*coordinates))
+
+
+def _coordinates(columns, n_points):
+    """
+    Combine columns of transformed v1, v2, v3 and v4 values to coordinates
+    """
+    (v1, v2, v3, v4) = (
+        list(column) if column is not None else [None] * n_points
+        for column in _make_4d(columns)
+    )
+    return [
+        {"v1": c1, "v2": c2, "v3": c3, "v4": c4}
+        for (c1, c2, c3, c4) in zip(v1, v2, v3, v4)
+    ]
+
+
+@app.post(
+    "/v1.2/trans/{src}/{dst}",
+    responses={
+        status.HTTP_200_OK: {"model": List[Coordinate]},
+        status.HTTP_400_BAD_REQUEST: {"model": HTTPError},
+        status.HTTP_404_NOT_FOUND: {"model": HTTPError},
+    },
+)
+def transformation_batch(
+    src: str, dst: str, coordinates: List[List[float]], approximate: bool = False
+):
+    """
+    Transform a batch of coordinates from one CRS to another
+
+    Coordinates are given as a list of 2D, 3D or 4D coordinates, e.g.
+    `[[56.0, 12.0], [55.0, 11.0]]`. All coordinates in a batch must have
+    the same dimension. Large batches are split in shards that are
+    transformed in parallel.
+
+    With `approximate=true` 2D and 3D coordinates are transformed by
+    interpolation in a precomputed mesh where the interpolation error is
+    known to be within the configured tolerance, and exactly elsewhere.
+    The mesh is built in the background the first time it is needed, and
+    coordinates are transformed exactly until it is ready.
+    """
+    if not coordinates:
+        return []
+
+    try:
+        columns = _columns(coordinates)
+        mesh = None
+        if approximate and len(columns) < 4:
+            # validates the CRS's before a mesh is built for them
+            TransformerFactory.create(src, dst)
+            mesh = MeshFactory.create(src, dst, wait=False)
+
+        out = SHARDED_TRANSFORMER.transform(src, dst, columns, transformer=mesh)
+    except ValueError as error:
+        return HTTPException(status_code=404, detail=error)
+
+    for column in out:
+        if column is not None and any(isinf(value) for value in column):
+            raise HTTPException(
+                status_code=404,
+                detail="Input coordinate outside area of use of either source or destination CRS",
+            )
+
+    return _coordinates(out, len(coordinates))
+
+
+def _fanout_stages(transformer, columns, shared):
+    """
+    Transform columns through the stages of a transformer, reusing the
+    output of stages that earlier targets of the fan-out have run through.
+    Transformations share legs where they go through the same hub, e.g. the
+    leg from the source to ETRS89 of all transformations to DK CRS's.
+    """
+    prefix = ()
+    out = _make_4d(columns)
+    for pipeline in transformer.stages().values():
+        prefix += (id(pipeline),)
+        if prefix not in shared:
+            # the pipeline is kept with its output so its id isn't reused
+            shared[prefix] = (pipeline, _make_4d(pipeline.transform(*out)))
+        out = shared[prefix][1]
+
+    return out
+
+
+@app.post(
+    "/v1.2/fanout/{src}",
+    responses={
+        status.HTTP_200_OK: {"model": Dict[str, FanoutResult]},
+        status.HTTP_400_BAD_REQUEST: {"model": HTTPError},
+    },
+)
+def transformation_fanout(src: str, fanout: FanoutInput):
+    """
+    Transform coordinates from one CRS to many
+
+    Each target gets the same result as a batch transformation, but legs
+    that the transformations share, like the leg to the hub of the region
+    (ETRS89 in Denmark and GR96 in Greenland) of targets that are
+    transformed through it, are only transformed once. If `targets` is left
+    out, the coordinates are transformed to all CRS's compatible with `src`.
+    The response holds the transformed coordinates of each target, or the
+    reason the target failed.
+    Coordinates outside the area of use of a target are returned as `null`.
+    """
+    src = src.upper()
+    if src not in CRS_LIST:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=_not_served(src) or f"Unknown source CRS identifier: '{src}'",
+        )
+
+    src_region = CRS_LIST[src]["country"]
+    targets = fanout.targets
+    if targets is None:
+        # global CRS's are compatible with regional CRS's only
+        if src_region == "Global":
+            compatible = set(HUBS)
+        else:
+            compatible = {src_region, "Global"}
+
+        targets = [
+            srid
+            for srid, crsinfo in CRS_LIST.items()
+            if crsinfo["country"] in compatible
+        ]
+
+    if not fanout.coordinates:
+        return {target.upper(): {"coordinates": []} for target in targets}
+
+    columns = _columns(fanout.coordinates)
+
+    trace = TRACE.get()
+    if trace is not None:
+        # the request is logged with all its targets
+        trace.src = src
+        trace.dst = ",".join(target.upper() for target in targets)
+        trace.dimension = len(columns)
+        trace.points = len(columns[0])
+
+    shared = {}
+    results = {}
+    for target in targets:
+        target = target.upper()
+        try:
+            if target not in CRS_LIST:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=_not_served(target)
+                    or f"Unknown destination CRS identifier: '{target}'",
+                )
+
+            # global CRS's are compatible with regional CRS's only
+            regions = {src_region, CRS_LIST[target]["country"]}
+            if src != target and regions == {"Global"}:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Global CRS's are only compatible with regional CRS's",
+                )
+
+            transformer = TransformerFactory.create(src, target)
+            out = _fanout_stages(transformer, columns, shared)[: len(columns)]
+        except HTTPException as error:
+            results[target] = {"detail": error.detail}
+            continue
+        except (ValueError, pyproj.exceptions.ProjError) as error:
+            results[target] = {"detail": str(error)}
+            continue
+
+        coordinates = _coordinates(out, len(fanout.coordinates))
+        results[target] = {
+            "coordinates": [
+                (
+                    None
+                    if any(v is not None and isinf(v) for v in coordinate.values())
+                    else coordinate
+                )
+                for coordinate in coordinates
+            ]
+        }
+
+    return results
+
+
+# Maximum number of coordinates in a message on a stream
+MAX_STREAM_COORDINATES = int(os.environ.get("WEBPROJ_STREAM_MAX_COORDINATES", 1000))
+
+
+def _stream_reply(transformer, text):
+    """
+    Transform the coordinates of a message received on a stream.
+
+    A message is either a single coordinate, e.g. `[56.0, 12.0]`, or a list
+    of coordinates of the same dimension. The reply has the same shape as the
+    message. Coordinates outside the area of use are returned as `null`.
+    """
+    message = json.loads(text)
+    if not isinstance(message, list) or not message:
+        raise ValueError("Message must be a coordinate or a list of coordinates")
+
+    single = not isinstance(message[0], list)
+    coordinates = [message] if single else message
+    if len(coordinates) > MAX_STREAM_COORDINATES:
+        raise ValueError(
+            f"Messages can hold at most {MAX_STREAM_COORDINATES} coordinates"
+        )
+
+    dimension = len(coordinates[0])
+    if dimension not in (2, 3, 4) or any(
+        not isinstance(c, list) or len(c) != dimension for c in coordinates
+    ):
+        raise ValueError("Coordinates must all be either 2D, 3D or 4D")
+
+    columns = tuple([float(value) for value in column] for column in zip(*coordinates))
+    out = transformer.transform_batch(columns)[:dimension]
+
+    reply = []
+    for coordinate in zip(*out):
+        if any(isinf(value) for value in coordinate):
+            reply.append(None)
+        else:
+            reply.append(list(coordinate))
+
+    return reply[0] if single else reply
+
+
+async def transformation_stream(websocket: WebSocket):
+    """
+    Transform a stream of coordinates from one CRS to another
+
+    The transformation is resolved once when the connection is opened, after
+    which each message is answered with the transformed coordinates.
+    """
+    await websocket.accept()
+
+    try:
+        transformer = TransformerFactory.create(
+            websocket.path_params["src"], websocket.path_params["dst"]
+        )
+    except HTTPException as error:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=error.detail)
+        return
+    except ValueError as error:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(error))
+        return
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            try:
+                text = message.get("text")
+                if text is None:
+                    raise ValueError("Messages must be text frames")
+                # transformed in a worker thread to keep the event loop free
+                reply = await run_in_threadpool(_stream_reply, transformer, text)
+            except (TypeError, ValueError) as error:
+                reply = {"detail": str(error)}
+
+            await websocket.send_text(json.dumps(reply, separators=(",", ":")))
+    except WebSocketDisconnect:
+        pass
+
+
+# The stream is added as a plain websocket route, since the token dependencies
+# of the app only apply to HTTP requests.
+app.router.routes.append(
+    WebSocketRoute("/v1.2/stream/{src}/{dst}", transformation_stream)
+)
+
+
 @app.get("/v1.2/info/")
 @app.get("/v1.2/info", include_in_schema=False)
 async def info() -> WEBPROJInfo:
@@ -524,3 +1882,103 @@ async def info() -> WEBPROJInfo:
         "webproj_version": __VERSION__,
         "proj_version": pyproj.__proj_version__,
     }
+
+
+@app.get("/v1.2/load/")
+@app.get("/v1.2/load", include_in_schema=False)
+async def load() -> Dict[str, GateStatus]:
+    """
+    Retrieve the concurrency limits, number of requests in flight and queue
+    depth for each class of routes (CRS metadata, transformations and batches).
+    """
+    return ADMISSION.status()
+
+
+@app.get(
+    "/admin/transformers/",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+@app.get(
+    "/admin/transformers",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+def admin_transformers() -> List[CachedTransformer]:
+    """
+    List the transformers cached in this worker with the pipelines and grids
+    they use, their construction time, usage and estimated memory footprint.
+    """
+    return TransformerFactory.describe()
+
+
+@app.post(
+    "/admin/reload/",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+@app.post(
+    "/admin/reload",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+def admin_reload() -> ReloadReport:
+    """
+    Reload data.json and the PROJ resource files in WEBPROJ_LIB, dropping
+    only the cached CRS info and transformers affected by changes.
+    """
+    return reload_registry()
+
+
+@app.get(
+    "/admin/grids/",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+@app.get(
+    "/admin/grids",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+def admin_grids() -> WarmupReport:
+    """
+    Report the grids loaded at startup with their size, load time and
+    whether they are missing.
+    """
+    return WARMUP_REPORT
+
+
+@app.get(
+    "/admin/profile/",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+@app.get(
+    "/admin/profile",
+    dependencies=[Depends(admin_access)],
+    include_in_schema=False,
+)
+def admin_profile(seconds: float = 10.0, idle: bool = False):
+    """
+    Profile this worker for a number of seconds by sampling the stacks of
+    all threads, and return the profile as collapsed stacks that can be
+    rendered as a flame graph. Idle threads are left out unless `idle=true`.
+    """
+    if seconds <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="seconds must be positive",
+        )
+
+    try:
+        (stacks, rounds) = profile(seconds, idle=idle)
+    except ProfilerBusy as error:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=str(error)
+        ) from error
+
+    return Response(
+        content=collapsed(stacks),
+        media_type="text/plain",
+        headers={"X-Profile-Samples": str(rounds)},
+    )
@@ -0,0 +1,228 @@
+"""
+Approximate transformations by interpolation in precomputed meshes.
+
+A mesh holds the exact transformation of a regular grid of nodes covering
+the area of use in source coordinates. Coordinates are then transformed by
+bicubic interpolation between the nodes, which is much cheaper than running
+the PROJ pipelines, in particular for pipelines with several steps or grids.
+
+Heights are handled as an offset interpolated from the mesh, which assumes
+that the height does not influence the horizontal result and only shifts
+the vertical result. Both assumptions are checked when the mesh is built.
+
+When the mesh is built, the interpolation error is checked against the exact
+transformation at the centre and edge midpoints of each cell, at both ends
+of the supported height range. Cells where the error exceeds the tolerance
+are marked invalid and coordinates falling in them are transformed exactly,
+as are coordinates outside the mesh or the height range and 4D coordinates.
+
+Interpolation only pays off for transformations that are expensive to run
+exactly. Mesh.speedup() times the mesh against the exact transformation, so
+meshes that aren't faster can be discarded.
+
+Configured with environment variables:
+
+    WEBPROJ_APPROXIMATE_TOLERANCE     maximum error in metres (default 0.0005)
+    WEBPROJ_APPROXIMATE_MESH          number of nodes along each axis (default 256)
+    WEBPROJ_APPROXIMATE_MIN_COVERAGE  minimum fraction of valid cells (default 0.5)
+"""
+import os
+import time
+
+import numpy as np
+
+TOLERANCE = float(os.environ.get("WEBPROJ_APPROXIMATE_TOLERANCE", 0.0005))
+MESH_SIZE = int(os.environ.get("WEBPROJ_APPROXIMATE_MESH", 256))
+MIN_COVERAGE = float(os.environ.get("WEBPROJ_APPROXIMATE_MIN_COVERAGE", 0.5))
+
+# Number of points used to time a mesh against the exact transformation
+BENCHMARK_POINTS = 20_000
+
+# Heights (metres) for which the height offset of the mesh is valid
+HEIGHT_RANGE = (-500.0, 4000.0)
+
+# Conversion of errors in degrees to metres. Conservative for longitudes.
+METRES_PER_DEGREE = 111_320.0
+
+# Positions within a cell where the interpolation error is checked
+_TEST_POSITIONS = ((0.5, 0.5), (0.5, 0.0), (0.5, 1.0), (0.0, 0.5), (1.0, 0.5))
+
+
+def _weights(t):
+    """
+    Cubic Lagrange weights of the nodes at -1, 0, 1 and 2 for position t
+    """
+    return (
+        -t * (t - 1) * (t - 2) / 6,
+        (t + 1) * (t - 1) * (t - 2) / 2,
+        -(t + 1) * t * (t - 2) / 2,
+        (t + 1) * t * (t - 1) / 6,
+    )
+
+
+def _stencil(size, i, j, tx, ty):
+    """
+    Stencil for position (tx, ty) of the cells with lower left node (i, j)
+    in a mesh of size x size nodes: the flat index of the lower left node
+    and the weights along both axes. Cells must have a node on either side,
+    i.e. 1 <= i <= size - 3.
+    """
+    return (size, i * size + j, _weights(tx), _weights(ty))
+
+
+def _bicubic(values, stencil):
+    """
+    Interpolate the values of the mesh nodes with a stencil. The nodes of
+    the stencil are gathered from the flattened values once each.
+    """
+    (size, base, wx, wy) = stencil
+    result = 0.0
+    for a in range(4):
+        row = 0.0
+        for b in range(4):
+            row = row + wy[b] * values.take(base + ((a - 1) * size + b - 1))
+        result = result + wx[a] * row
+
+    return result
+
+
+class Mesh:
+    """
+    Interpolation mesh for a transformation.
+
+    `transformer` is the exact transformation (an OptimusPrime), `bounds` are
+    the (v1_min, v2_min, v1_max, v2_max) bounds of the mesh in source
+    coordinates and `scale` converts horizontal output units to metres.
+    """
+
+    def __init__(
+        self, transformer, bounds, scale=1.0, size=MESH_SIZE, tolerance=TOLERANCE
+    ):
+        self.transformer = transformer
+        self.bounds = bounds
+        self.size = size
+        self.tolerance = tolerance
+        self.step = (
+            (bounds[2] - bounds[0]) / (size - 1),
+            (bounds[3] - bounds[1]) / (size - 1),
+        )
+
+        (v1, v2) = np.meshgrid(
+            np.linspace(bounds[0], bounds[2], size),
+            np.linspace(bounds[1], bounds[3], size),
+            indexing="ij",
+        )
+        (self.v1, self.v2, self.dz) = self._exact(v1, v2, 0.0)
+
+        # Cells along the border lack the neighbouring nodes needed for
+        # bicubic interpolation and are transformed exactly
+        (i, j) = np.meshgrid(
+            np.arange(1, size - 2), np.arange(1, size - 2), indexing="ij"
+        )
+
+        error = np.zeros(i.shape)
+        for (tx, ty) in _TEST_POSITIONS:
+            stencil = _stencil(size, i, j, tx, ty)
+            approx = (
+                _bicubic(self.v1, stencil),
+                _bicubic(self.v2, stencil),
+                _bicubic(self.dz, stencil),
+            )
+            test_v1 = bounds[0] + (i + tx) * self.step[0]
+            test_v2 = bounds[1] + (j + ty) * self.step[1]
+            for height in HEIGHT_RANGE:
+                exact = self._exact(test_v1, test_v2, height)
+                error = np.maximum(error, np.abs(approx[0] - exact[0]) * scale)
+                error = np.maximum(error, np.abs(approx[1] - exact[1]) * scale)
+                error = np.maximum(error, np.abs(approx[2] + height - exact[2]))
+
+        # errors are NaN where the exact transformation returns inf
+        error = np.where(np.isfinite(error), error, np.inf)
+
+        self.valid = np.zeros((size - 1, size - 1), dtype=bool)
+        self.valid[1:-1, 1:-1] = error <= tolerance
+        within = error[error <= tolerance]
+        self.max_error = float(within.max()) if within.size else None
+
+    def _exact(self, v1, v2, height):
+        shape = v1.shape
+        columns = (v1.ravel(), v2.ravel(), np.full(v1.size, height))
+        out = self.transformer.transform_batch(columns)
+        return tuple(
+            np.asarray(column, dtype=float).reshape(shape) for column in out[:3]
+        )
+
+    @property
+    def coverage(self):
+        """Fraction of cells where the interpolation is within tolerance"""
+        return float(self.valid.mean())
+
+    def speedup(self, n_points=BENCHMARK_POINTS, repeat=3):
+        """
+        Time of the exact transformation of random points within the mesh
+        relative to the time of the approximate transformation
+        """
+        rng = np.random.default_rng(0)
+        columns = (
+            rng.uniform(self.bounds[0], self.bounds[2], n_points).tolist(),
+            rng.uniform(self.bounds[1], self.bounds[3], n_points).tolist(),
+            rng.uniform(0.0, 100.0, n_points).tolist(),
+        )
+
+        def best(transform):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                transform(columns)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        return best(self.transformer.transform_batch) / best(self.transform_batch)
+
+    def transform_batch(self, columns):
+        """
+        Transform a batch of coordinates given as columns of v1, v2 and v3
+        values, interpolating where possible and transforming exactly
+        elsewhere. Returns columns like OptimusPrime.transform_batch().
+        """
+        if len(columns) == 4:
+            return self.transformer.transform_batch(columns)
+
+        columns = tuple(np.asarray(column, dtype=float) for column in columns)
+        f1 = (columns[0] - self.bounds[0]) / self.step[0]
+        f2 = (columns[1] - self.bounds[1]) / self.step[1]
+        with np.errstate(invalid="ignore"):
+            i = np.floor(f1)
+            j = np.floor(f2)
+            # border cells can't be interpolated and are transformed exactly
+            last = self.size - 3
+            inside = (i >= 1) & (i <= last) & (j >= 1) & (j <= last)
+
+        # clipped only to look up the cells; points outside the cells that
+        # can be interpolated are transformed exactly
+        i = np.clip(np.nan_to_num(i), 1, self.size - 3).astype(np.intp)
+        j = np.clip(np.nan_to_num(j), 1, self.size - 3).astype(np.intp)
+        valid = inside & self.valid[i, j]
+        if len(columns) == 3:
+            valid &= (columns[2] >= HEIGHT_RANGE[0]) & (columns[2] <= HEIGHT_RANGE[1])
+
+        out = [np.empty(len(column)) for column in columns]
+        if valid.any():
+            # interpolate only the points in valid cells
+            index = slice(None) if valid.all() else valid
+            (i, j) = (i[index], j[index])
+            stencil = _stencil(self.size, i, j, f1[index] - i, f2[index] - j)
+            out[0][index] = _bicubic(self.v1, stencil)
+            out[1][index] = _bicubic(self.v2, stencil)
+            if len(columns) == 3:
+                out[2][index] = columns[2][index] + _bicubic(self.dz, stencil)
+
+        exact = ~valid
+        if exact.any():
+            fallback = self.transformer.transform_batch(
+                tuple(column[exact] for column in columns)
+            )
+            for column, values in zip(out, fallback):
+                column[exact] = values
+
+        return tuple(column.tolist() for column in out) + (None,) * (4 - len(out))
@@ -0,0 +1,369 @@
+"""
+Command line tool for bulk transformation of coordinate files.
+
+Files are transformed with the same transformers as the API, without going
+through HTTP. The input is read in chunks that are transformed in parallel
+by a pool of worker processes and written in order as soon as they are
+done, so files of any size can be transformed in constant memory.
+
+Supported formats:
+
+    csv      one coordinate per line, e.g. `55.0,12.0,30.0`. Columns after
+             the coordinate are passed through unchanged. The dimension must
+             be given unless the header names the coordinate columns.
+    ndjson   one JSON list per line, e.g. `[55.0, 12.0, 30.0]`. Written as
+             one JSON object per line like the API returns them.
+    binary   little-endian 64-bit floats, `--dimension` values per coordinate
+
+Coordinates outside the area of use of the transformation are written as
+empty fields (csv), null (ndjson) or NaN (binary).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import isinf, nan
+
+import numpy as np
+
+CHUNK_SIZE = 100_000
+
+# Transformer used by the worker process
+_TRANSFORMER = None
+
+
+def _init_worker(src, dst):
+    global _TRANSFORMER  # pylint: disable=global-statement
+    # pylint: disable-next=import-outside-toplevel
+    from webproj.api import TransformerFactory
+
+    _TRANSFORMER = TransformerFactory.create(src, dst)
+
+
+def _transform(columns):
+    """
+    Transform columns of coordinates. Returns the transformed columns and a
+    list of flags for the coordinates outside the area of use.
+    """
+    out = _TRANSFORMER.transform_batch(columns)[: len(columns)]
+    outside = [any(isinf(value) for value in values) for values in zip(*out)]
+    return (out, outside)
+
+
+def _parse_csv(lines, dimension, delimiter):
+    columns = [[] for _ in range(dimension)]
+    rest = []
+    for line in lines:
+        fields = line.rstrip("\r\n").split(delimiter)
+        if len(fields) < dimension:
+            raise ValueError(
+                f"Expected {dimension} coordinate values in line: {line!r}"
+            )
+        for column, field in zip(columns, fields):
+            column.append(float(field))
+        rest.append(fields[dimension:])
+
+    return (tuple(columns), rest)
+
+
+def _process_csv(lines, dimension, delimiter):
+    (columns, rest) = _parse_csv(lines, dimension, delimiter)
+    (out, outside) = _transform(columns)
+    output = []
+    for values, extra, failed in zip(zip(*out), rest, outside):
+        if failed:
+            fields = [""] * dimension
+        else:
+            fields = [repr(value) for value in values]
+        output.append(delimiter.join(fields + extra) + "\n")
+
+    return ("".join(output), len(lines), sum(outside))
+
+
+def _process_ndjson(lines, dimension, delimiter):
+    # imported here so the API is imported in the worker processes only
+    from webproj.api import _coordinates  # pylint: disable=import-outside-toplevel
+
+    coordinates = [json.loads(line) for line in lines]
+    if any(len(coordinate) != dimension for coordinate in coordinates):
+        raise ValueError(f"Coordinates must all be {dimension}D")
+    columns = tuple(list(column) for column in zip(*coordinates))
+    (out, outside) = _transform(columns)
+    output = []
+    for coordinate, failed in zip(_coordinates(out, len(coordinates)), outside):
+        if failed:
+            coordinate = None
+        # serialized the same way as FastAPI's JSONResponse
+        output.append(
+            json.dumps(coordinate, ensure_ascii=False, separators=(",", ":")) + "\n"
+        )
+
+    return ("".join(output), len(lines), sum(outside))
+
+
+def _process_binary(data, dimension, delimiter):
+    values = np.frombuffer(data, dtype="<f8").reshape(-1, dimension)
+    columns = tuple(values[:, i].tolist() for i in range(dimension))
+    (out, outside) = _transform(columns)
+    result = np.array(out, dtype="<f8").T
+    result[np.array(outside, dtype=bool)] = nan
+    return (result.tobytes(), len(values), sum(outside))
+
+
+_PROCESS = {
+    "csv": _process_csv,
+    "ndjson": _process_ndjson,
+    "binary": _process_binary,
+}
+
+
+def _text_chunks(stream, chunk_size):
+    chunk = []
+    for line in stream:
+        if not line.strip():
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _binary_chunks(stream, chunk_size, dimension):
+    record = 8 * dimension
+    while True:
+        data = stream.read(record * chunk_size)
+        if not data:
+            return
+        if len(data) % record:
+            raise ValueError(f"Input size is not a multiple of {record} bytes")
+        yield data
+
+
+# Header names of coordinate columns in CSV files
+_COORDINATE_NAMES = set(
+    "v1 v2 v3 v4 x y z t e n h east north easting northing "
+    "lat lon long latitude longitude height epoch time".split()
+)
+
+
+def _infer_dimension(fmt, first, delimiter, header=None):
+    """
+    Dimension of the coordinates of a text file. For CSV files it's the
+    number of leading header fields that name coordinate columns, as
+    numeric columns after the coordinate can't be told apart from it.
+    """
+    if fmt != "csv":
+        return len(json.loads(first))
+
+    dimension = 0
+    if header is not None:
+        for field in header.rstrip("\r\n").split(delimiter)[:4]:
+            if field.strip().lower() not in _COORDINATE_NAMES:
+                break
+            dimension += 1
+    if dimension < 2:
+        raise ValueError(
+            "The dimension must be given for CSV input without a header "
+            "naming the coordinate columns"
+        )
+    return dimension
+
+
+class _Progress:
+    """
+    Progress report and throughput statistics written to stderr
+    """
+
+    def __init__(self, quiet, interval=1.0):
+        self.quiet = quiet
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.reported = self.start
+        self.points = 0
+        self.outside = 0
+
+    def update(self, points, outside):
+        self.points += points
+        self.outside += outside
+        now = time.perf_counter()
+        if not self.quiet and now - self.reported >= self.interval:
+            self.reported = now
+            rate = self.points / (now - self.start)
+            print(f"{self.points} points, {rate:.0f} points/s", file=sys.stderr)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        rate = self.points / elapsed if elapsed > 0 else 0.0
+        if not self.quiet:
+            print(
+                f"Transformed {self.points} points in {elapsed:.2f} s "
+                f"({rate:.0f} points/s), {self.outside} outside area of use",
+                file=sys.stderr,
+            )
+        return {"points": self.points, "outside": self.outside, "seconds": elapsed}
+
+
+def transform_file(  # pylint: disable=too-many-arguments,too-many-locals
+    src,
+    dst,
+    infile,
+    outfile,
+    fmt="csv",
+    dimension=None,
+    delimiter=",",
+    header=False,
+    chunk_size=CHUNK_SIZE,
+    workers=None,
+    quiet=True,
+):
+    """
+    Transform the coordinates in the stream infile from src to dst and
+    write them to outfile. Binary streams are used for the binary format
+    and text streams otherwise. Returns throughput statistics.
+    """
+    workers = workers or os.cpu_count()
+
+    if fmt == "binary":
+        if dimension is None:
+            raise ValueError("The dimension must be given for binary input")
+        chunks = _binary_chunks(infile, chunk_size, dimension)
+    else:
+        header_line = None
+        if header:
+            header_line = infile.readline()
+            outfile.write(header_line)
+        chunks = _text_chunks(infile, chunk_size)
+        first = next(chunks, None)
+        if first is None:
+            return _Progress(quiet).summary()
+        if dimension is None:
+            dimension = _infer_dimension(fmt, first[0], delimiter, header_line)
+        chunks = _chain(first, chunks)
+
+    if dimension not in (2, 3, 4):
+        raise ValueError("Coordinates must be either 2D, 3D or 4D")
+
+    process = _PROCESS[fmt]
+    progress = _Progress(quiet)
+
+    if workers == 1:
+        _init_worker(src, dst)
+        for chunk in chunks:
+            (output, points, outside) = process(chunk, dimension, delimiter)
+            outfile.write(output)
+            progress.update(points, outside)
+        return progress.summary()
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(src, dst)
+    ) as pool:
+        # a bounded number of chunks in flight keeps memory use constant
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(process, chunk, dimension, delimiter))
+            if len(pending) >= 2 * workers:
+                (output, points, outside) = pending.popleft().result()
+                outfile.write(output)
+                progress.update(points, outside)
+        while pending:
+            (output, points, outside) = pending.popleft().result()
+            outfile.write(output)
+            progress.update(points, outside)
+
+    return progress.summary()
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+def main(argv=None):
+    """
+    Entry point of the webproj command
+    """
+    parser = argparse.ArgumentParser(
+        prog="webproj",
+        description="Transform coordinate files with the WEBPROJ transformations.",
+    )
+    parser.add_argument("src", help="source CRS, e.g. EPSG:4258")
+    parser.add_argument("dst", help="destination CRS, e.g. EPSG:25832")
+    parser.add_argument("input", help="input file, - for stdin")
+    parser.add_argument("output", help="output file, - for stdout")
+    parser.add_argument("--format", choices=sorted(_PROCESS), default="csv")
+    parser.add_argument(
+        "--dimension",
+        type=int,
+        choices=(2, 3, 4),
+        help="coordinate dimension, required for CSV input without a header "
+        "naming the coordinate columns and for binary input",
+    )
+    parser.add_argument("--delimiter", default=",", help="CSV delimiter")
+    parser.add_argument("--header", action="store_true", help="CSV input has a header")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        "--workers", type=int, help="number of worker processes (default is all cores)"
+    )
+    parser.add_argument("--quiet", action="store_true", help="no progress report")
+    args = parser.parse_args(argv)
+
+    # imported here so --help doesn't pay for setting up the API
+    from fastapi import HTTPException  # pylint: disable=import-outside-toplevel
+    from pyproj.exceptions import ProjError  # pylint: disable=import-outside-toplevel
+
+    # pylint: disable-next=import-outside-toplevel
+    from webproj.api import TransformerFactory
+
+    try:
+        TransformerFactory.create(args.src, args.dst)
+    except HTTPException as error:
+        parser.exit(2, f"webproj: {error.detail}\n")
+    except (ValueError, ProjError) as error:
+        parser.exit(2, f"webproj: {error}\n")
+
+    binary = args.format == "binary"
+    mode = "b" if binary else ""
+    encoding = None if binary else "UTF-8"
+    if args.input == "-":
+        infile = sys.stdin.buffer if binary else sys.stdin
+    else:
+        # pylint: disable-next=consider-using-with
+        infile = open(args.input, "r" + mode, encoding=encoding)
+    if args.output == "-":
+        outfile = sys.stdout.buffer if binary else sys.stdout
+    else:
+        # pylint: disable-next=consider-using-with
+        outfile = open(args.output, "w" + mode, encoding=encoding)
+
+    try:
+        transform_file(
+            args.src,
+            args.dst,
+            infile,
+            outfile,
+            fmt=args.format,
+            dimension=args.dimension,
+            delimiter=args.delimiter,
+            header=args.header,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            quiet=args.quiet,
+        )
+    except ValueError as error:
+        parser.exit(1, f"webproj: {error}\n")
+    finally:
+        if infile not in (sys.stdin, sys.stdin.buffer):
+            infile.close()
+        if outfile not in (sys.stdout, sys.stdout.buffer):
+            outfile.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,575 @@
+"""
+Client for the WEBPROJ API.
+
+The clients keep a pool of keep-alive connections to the API and buffer
+single coordinate transformations into batch requests, so callers get the
+throughput of batches without having to collect coordinates themselves.
+Coordinates for the same pair of CRS's and of the same dimension that are
+requested within `batch_delay` seconds of each other are sent together in
+one request of at most `batch_size` coordinates.
+
+CRS metadata and transformed coordinates are cached locally. Requests that
+are rejected with 503 Service Unavailable because the API is busy are
+retried with exponential backoff, respecting the Retry-After header.
+
+Synchronous use, batching coordinates queued with submit() or calls to
+transform() made concurrently from several threads. A single thread calling
+transform() in a loop sends one request per coordinate, so coordinates of
+one thread should be queued with submit() or sent with transform_batch():
+
+    with Client("https://api.dataforsyningen.dk/rest/webproj") as client:
+        futures = [client.submit("EPSG:4258", "EPSG:25832", c) for c in coords]
+        results = [future.result() for future in futures]
+
+Asynchronous use, batching concurrent calls:
+
+    async with AsyncClient("https://api.dataforsyningen.dk/rest/webproj") as client:
+        results = await asyncio.gather(
+            *(client.transform("EPSG:4258", "EPSG:25832", c) for c in coords)
+        )
+
+Transformed coordinates are returned as dicts with v1, v2, v3 and v4 like
+the API does.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import httpx
+
+API_VERSION = "v1.2"
+
+BATCH_SIZE = 1000
+BATCH_DELAY = 0.005
+RETRIES = 5
+BACKOFF = 0.1
+CACHE_SIZE = 100_000
+MAX_CONNECTIONS = 10
+
+
+class WebprojError(Exception):
+    """Error returned by the WEBPROJ API"""
+
+    def __init__(self, status_code, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _ResultCache:
+    """
+    Thread-safe LRU cache of transformed coordinates
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            result = self._items.get(key)
+            if result is not None:
+                self._items.move_to_end(key)
+        return dict(result) if result is not None else None
+
+    def put(self, key, result):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._items[key] = dict(result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class _BaseClient:
+    """
+    Configuration and helpers shared by the sync and async clients
+    """
+
+    def __init__(
+        self,
+        token=None,
+        batch_size=BATCH_SIZE,
+        batch_delay=BATCH_DELAY,
+        retries=RETRIES,
+        backoff=BACKOFF,
+        cache_size=CACHE_SIZE,
+    ):
+        self.headers = {"token": token} if token is not None else {}
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.retries = retries
+        self.backoff = backoff
+        self.results = _ResultCache(cache_size)
+        self._crs = {}
+
+    @staticmethod
+    def _key(src, dst, coordinate):
+        return (src.upper(), dst.upper(), tuple(coordinate))
+
+    def _retry_delay(self, response, attempt):
+        """
+        Seconds to wait before retrying, or None if the request should not
+        be retried
+        """
+        if response.status_code != 503 or attempt >= self.retries:
+            return None
+
+        delay = self.backoff * 2**attempt * (1 + random.random())
+        try:
+            return max(delay, float(response.headers.get("Retry-After", 0)))
+        except ValueError:
+            return delay
+
+    @staticmethod
+    def _decode(response):
+        """
+        Decode the JSON body of a response, raising WebprojError on errors
+        """
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"detail": response.text}
+
+        if response.status_code >= 400:
+            raise WebprojError(response.status_code, body.get("detail"))
+
+        # some entry-points report errors in the body of a 200 response
+        if isinstance(body, dict) and "status_code" in body and "detail" in body:
+            raise WebprojError(body["status_code"], body["detail"])
+
+        return body
+
+    def _cached_or_none(self, src, dst, coordinates):
+        return [self.results.get(self._key(src, dst, c)) for c in coordinates]
+
+    def _store(self, src, dst, coordinates, results):
+        for coordinate, result in zip(coordinates, results):
+            self.results.put(self._key(src, dst, coordinate), result)
+
+    def clear_cache(self):
+        """Drop cached CRS metadata and transformed coordinates"""
+        self._crs.clear()
+        self.results.clear()
+
+
+class Client(_BaseClient):
+    """
+    Synchronous WEBPROJ client.
+
+    `base_url` is the URL of the API, e.g. "http://127.0.0.1:8000". `token`
+    is sent in the token header. An existing httpx.Client can be given as
+    `http`, in which case `base_url` is ignored.
+    """
+
+    def __init__(
+        self,
+        base_url="http://127.0.0.1:8000",
+        token=None,
+        http=None,
+        max_connections=MAX_CONNECTIONS,
+        **kwargs,
+    ):
+        super().__init__(token=token, **kwargs)
+        if http is None:
+            http = httpx.Client(
+                base_url=base_url,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            )
+        self.http = http
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_connections, thread_name_prefix="webproj-client"
+        )
+        self._pending = {}
+        self._condition = threading.Condition()
+        # number of threads waiting in transform()
+        self._waiting = 0
+        self._batcher = None
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Send buffered coordinates and close the connections"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._batcher is not None:
+            self._batcher.join()
+        self._executor.shutdown(wait=True)
+        self.http.close()
+
+    def _request(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            response = self.http.request(method, path, headers=self.headers, **kwargs)
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                return self._decode(response)
+            time.sleep(delay)
+            attempt += 1
+
+    def crs(self, srid):
+        """Information about a CRS, cached after the first request"""
+        srid = srid.upper()
+        if srid not in self._crs:
+            self._crs[srid] = self._request("GET", f"/{API_VERSION}/crs/{srid}")
+        return self._crs[srid]
+
+    def catalogue(self, country=None):
+        """
+        Information about all CRS's, or those of a country. The CRS's are
+        cached for later calls to crs().
+        """
+        params = {"country": country} if country is not None else None
+        catalogue = self._request("GET", f"/{API_VERSION}/catalogue/", params=params)
+        self._crs.update(catalogue)
+        return catalogue
+
+    def transform_batch(self, src, dst, coordinates):
+        """
+        Transform a list of coordinates, which must all have the same
+        dimension. Coordinates that are cached are not sent again.
+        Coordinates outside the area of use are returned as None.
+        """
+        results = self._cached_or_none(src, dst, coordinates)
+        missing = [i for i, result in enumerate(results) if result is None]
+        for start in range(0, len(missing), self.batch_size):
+            indices = missing[start : start + self.batch_size]
+            chunk = [coordinates[i] for i in indices]
+            for i, result in zip(indices, self._transform_chunk(src, dst, chunk)):
+                results[i] = result
+
+        return results
+
+    def _transform_chunk(self, src, dst, chunk):
+        try:
+            out = self._request("POST", f"/{API_VERSION}/trans/{src}/{dst}", json=chunk)
+        except WebprojError as error:
+            if error.status_code != 404:
+                raise
+            if len(chunk) == 1:
+                return [None]
+            # one or more coordinates outside the area of use fail the
+            # whole batch, so find them by splitting it up
+            middle = len(chunk) // 2
+            first = self._transform_chunk(src, dst, chunk[:middle])
+            return first + self._transform_chunk(src, dst, chunk[middle:])
+
+        self._store(src, dst, chunk, out)
+        return out
+
+    def submit(self, src, dst, coordinate):
+        """
+        Queue a coordinate for transformation. Returns a Future of the
+        transformed coordinate.
+        """
+        future = Future()
+        result = self.results.get(self._key(src, dst, coordinate))
+        if result is not None:
+            future.set_result(result)
+            return future
+
+        key = (src.upper(), dst.upper(), len(coordinate))
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Client is closed")
+            if self._batcher is None:
+                self._batcher = threading.Thread(
+                    target=self._run, name="webproj-client-batcher", daemon=True
+                )
+                self._batcher.start()
+            (_, items) = self._pending.setdefault(key, (time.monotonic(), []))
+            items.append((tuple(coordinate), future))
+            if len(items) == 1 or len(items) >= self.batch_size:
+                self._condition.notify()
+
+        return future
+
+    def transform(self, src, dst, coordinate):
+        """
+        Transform a single coordinate. Calls made concurrently from several
+        threads are sent together in batches. A call made while no other
+        thread is waiting for its result is sent at once instead of waiting
+        for more coordinates, so it is not batched; use submit() or
+        transform_batch() to batch the coordinates of a single thread.
+        """
+        future = self.submit(src, dst, coordinate)
+        with self._condition:
+            self._waiting += 1
+            alone = self._waiting == 1
+        try:
+            if alone and not future.done():
+                self._flush_keys([(src.upper(), dst.upper(), len(coordinate))])
+            return future.result()
+        finally:
+            with self._condition:
+                self._waiting -= 1
+
+    def flush(self):
+        """Send all buffered coordinates now"""
+        with self._condition:
+            keys = list(self._pending)
+        self._flush_keys(keys)
+
+    def _flush_keys(self, keys):
+        """Send the buffered coordinates of the given keys now"""
+        with self._condition:
+            pending = [(key, self._pending.pop(key, None)) for key in keys]
+        for key, entry in pending:
+            if entry is None:
+                continue
+            (_, items) = entry
+            for start in range(0, len(items), self.batch_size):
+                self._executor.submit(
+                    self._send, key, items[start : start + self.batch_size]
+                )
+
+    def _run(self):
+        """
+        Dispatch buffered coordinates when a batch is full or has waited for
+        batch_delay seconds
+        """
+        with self._condition:
+            while self._pending or not self._closed:
+                now = time.monotonic()
+                ready = [
+                    key
+                    for key, (since, items) in self._pending.items()
+                    if self._closed
+                    or len(items) >= self.batch_size
+                    or now - since >= self.batch_delay
+                ]
+                if not ready:
+                    timeout = None
+                    if self._pending:
+                        oldest = min(since for (since, _) in self._pending.values())
+                        timeout = oldest + self.batch_delay - now
+                    self._condition.wait(timeout)
+                    continue
+
+                for key in ready:
+                    (_, items) = self._pending.pop(key)
+                    for start in range(0, len(items), self.batch_size):
+                        self._executor.submit(
+                            self._send, key, items[start : start + self.batch_size]
+                        )
+
+    def _send(self, key, items):
+        (src, dst, _) = key
+        try:
+            out = self._request(
+                "POST", f"/{API_VERSION}/trans/{src}/{dst}", json=[c for c, _ in items]
+            )
+        except WebprojError as error:
+            if error.status_code == 404 and len(items) > 1:
+                # one or more coordinates outside the area of use fail the
+                # whole batch, so find them by splitting it up
+                middle = len(items) // 2
+                self._send(key, items[:middle])
+                self._send(key, items[middle:])
+                return
+            for _, future in items:
+                future.set_exception(error)
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future in items:
+                future.set_exception(error)
+            return
+
+        for (coordinate, future), result in zip(items, out):
+            self.results.put((src, dst, coordinate), result)
+            future.set_result(result)
+
+
+class AsyncClient(_BaseClient):
+    """
+    Asynchronous WEBPROJ client.
+
+    `base_url` is the URL of the API, e.g. "http://127.0.0.1:8000". `token`
+    is sent in the token header. An existing httpx.AsyncClient can be given
+    as `http`, in which case `base_url` is ignored.
+    """
+
+    def __init__(
+        self,
+        base_url="http://127.0.0.1:8000",
+        token=None,
+        http=None,
+        max_connections=MAX_CONNECTIONS,
+        **kwargs,
+    ):
+        super().__init__(token=token, **kwargs)
+        if http is None:
+            http = httpx.AsyncClient(
+                base_url=base_url,
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            )
+        self.http = http
+        self._pending = {}
+        self._tasks = set()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Send buffered coordinates and close the connections"""
+        await self.flush()
+        await self.http.aclose()
+
+    async def _request(self, method, path, **kwargs):
+        attempt = 0
+        while True:
+            response = await self.http.request(
+                method, path, headers=self.headers, **kwargs
+            )
+            delay = self._retry_delay(response, attempt)
+            if delay is None:
+                return self._decode(response)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def crs(self, srid):
+        """Information about a CRS, cached after the first request"""
+        srid = srid.upper()
+        if srid not in self._crs:
+            self._crs[srid] = await self._request("GET", f"/{API_VERSION}/crs/{srid}")
+        return self._crs[srid]
+
+    async def catalogue(self, country=None):
+        """
+        Information about all CRS's, or those of a country. The CRS's are
+        cached for later calls to crs().
+        """
+        params = {"country": country} if country is not None else None
+        catalogue = await self._request(
+            "GET", f"/{API_VERSION}/catalogue/", params=params
+        )
+        self._crs.update(catalogue)
+        return catalogue
+
+    async def transform_batch(self, src, dst, coordinates):
+        """
+        Transform a list of coordinates, which must all have the same
+        dimension. Coordinates that are cached are not sent again.
+        Coordinates outside the area of use are returned as None.
+        """
+        results = self._cached_or_none(src, dst, coordinates)
+        missing = [i for i, result in enumerate(results) if result is None]
+        for start in range(0, len(missing), self.batch_size):
+            indices = missing[start : start + self.batch_size]
+            chunk = [coordinates[i] for i in indices]
+            out = await self._transform_chunk(src, dst, chunk)
+            for i, result in zip(indices, out):
+                results[i] = result
+
+        return results
+
+    async def _transform_chunk(self, src, dst, chunk):
+        try:
+            out = await self._request(
+                "POST", f"/{API_VERSION}/trans/{src}/{dst}", json=chunk
+            )
+        except WebprojError as error:
+            if error.status_code != 404:
+                raise
+            if len(chunk) == 1:
+                return [None]
+            # one or more coordinates outside the area of use fail the
+            # whole batch, so find them by splitting it up
+            middle = len(chunk) // 2
+            first = await self._transform_chunk(src, dst, chunk[:middle])
+            return first + await self._transform_chunk(src, dst, chunk[middle:])
+
+        self._store(src, dst, chunk, out)
+        return out
+
+    async def transform(self, src, dst, coordinate):
+        """
+        Transform a single coordinate. Concurrent calls are sent together
+        in batches.
+        """
+        result = self.results.get(self._key(src, dst, coordinate))
+        if result is not None:
+            return result
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        key = (src.upper(), dst.upper(), len(coordinate))
+        if key not in self._pending:
+            handle = loop.call_later(self.batch_delay, self._dispatch, key)
+            self._pending[key] = (handle, [])
+        (_, items) = self._pending[key]
+        items.append((tuple(coordinate), future))
+        if len(items) >= self.batch_size:
+            self._dispatch(key)
+
+        return await future
+
+    async def flush(self):
+        """Send all buffered coordinates and wait for the replies"""
+        for key in list(self._pending):
+            self._dispatch(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _dispatch(self, key):
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        (handle, items) = pending
+        handle.cancel()
+        task = asyncio.get_running_loop().create_task(self._send(key, items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, key, items):
+        (src, dst, _) = key
+        try:
+            out = await self._request(
+                "POST", f"/{API_VERSION}/trans/{src}/{dst}", json=[c for c, _ in items]
+            )
+        except WebprojError as error:
+            if error.status_code == 404 and len(items) > 1:
+                # one or more coordinates outside the area of use fail the
+                # whole batch, so find them by splitting it up
+                middle = len(items) // 2
+                await self._send(key, items[:middle])
+                await self._send(key, items[middle:])
+                return
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for (coordinate, future), result in zip(items, out):
+            self.results.put((src, dst, coordinate), result)
+            if not future.done():
+                future.set_result(result)
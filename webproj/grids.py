@@ -0,0 +1,94 @@
+"""
+Helpers for the datum grids used by PROJ pipelines.
+"""
+import os
+import time
+
+import pyproj
+
+# PROJ parameters that reference grid files
+GRID_PARAMETERS = ("grids", "geoidgrids", "nadgrids")
+
+
+def grids_in_definition(definition, optional=True):
+    """
+    List the names of the grids referenced in a PROJ definition string.
+    Optional grids, prefixed with @, are left out if `optional` is False.
+    """
+    grids = []
+    for token in definition.split():
+        key, _, value = token.lstrip("+").partition("=")
+        if key not in GRID_PARAMETERS:
+            continue
+
+        for name in value.split(","):
+            # grids prefixed with @ are optional
+            if name.startswith("@") and not optional:
+                continue
+            name = name.lstrip("@")
+            if name and name != "null" and name not in grids:
+                grids.append(name)
+
+    return grids
+
+
+def data_dirs():
+    """
+    Directories searched by PROJ for resource files
+    """
+    dirs = pyproj.datadir.get_data_dir().split(os.pathsep)
+    dirs.append(pyproj.datadir.get_user_data_dir())
+    return [d for d in dirs if d]
+
+
+def find_grid(name):
+    """
+    Locate a grid file in the PROJ data directories.
+
+    Returns the path of the grid file or None if it is not found.
+    """
+    if os.path.isabs(name):
+        return name if os.path.isfile(name) else None
+
+    for directory in data_dirs():
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def load_grid(path, block_size=1024 * 1024):
+    """
+    Read a grid file from end to end so it is resident in the page cache
+    before PROJ opens it. Returns the size of the file and the time it took.
+    """
+    start = time.perf_counter()
+    size = 0
+    with open(path, "rb") as grid:
+        while True:
+            block = grid.read(block_size)
+            if not block:
+                break
+            size += len(block)
+
+    return (size, time.perf_counter() - start)
+
+
+def snapshot():
+    """
+    Size and modification time of the files in the PROJ data directories,
+    keyed by file name
+    """
+    files = {}
+    for directory in data_dirs():
+        if not os.path.isdir(directory):
+            continue
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name not in files:
+                    stat = entry.stat()
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+
+    return files
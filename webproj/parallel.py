@@ -0,0 +1,115 @@
+"""
+Sharded execution of large coordinate batches.
+
+Large batches are split into shards that are transformed concurrently on a
+pool of worker threads. PROJ releases the GIL while transforming, so the
+shards run on separate cores. The worker threads share the transformers of
+the API. Their legs are pyproj Transformers, which keep a separate PROJ
+object for each thread, so no PROJ objects are shared between threads.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from webproj.slowlog import TRACE
+
+# Batches with fewer points than this are transformed inline
+SHARD_THRESHOLD = int(os.environ.get("WEBPROJ_SHARD_THRESHOLD", 50_000))
+
+# Number of worker threads used for sharded transformations
+WORKERS = int(os.environ.get("WEBPROJ_WORKERS", os.cpu_count() or 1))
+
+
+def _split(n_points, n_shards):
+    """
+    Split the range [0, n_points) into at most n_shards contiguous slices
+    """
+    size, rest = divmod(n_points, n_shards)
+    start = 0
+    for i in range(n_shards):
+        stop = start + size + (1 if i < rest else 0)
+        if stop > start:
+            yield slice(start, stop)
+        start = stop
+
+
+class ShardedTransformer:
+    """
+    Transform batches of coordinates, splitting large batches in shards
+    that are processed in parallel.
+
+    `create` returns the transformer from a source to a destination CRS
+    identifier. The worker threads share it, as its legs keep a separate
+    PROJ object for each thread.
+    """
+
+    def __init__(self, create, workers=WORKERS, threshold=SHARD_THRESHOLD):
+        self.create = create
+        self.workers = max(1, workers)
+        self.threshold = max(1, threshold)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="webproj-shard"
+                )
+        return self._executor
+
+    def transform(self, src, dst, columns, transformer=None):
+        """
+        Transform a batch of coordinates given as a tuple of columns, with
+        `transformer` if given, e.g. an approximation of the transformation,
+        and otherwise with the transformer from src to dst.
+
+        Returns the transformed columns in the same order as the input.
+        """
+        # Resolving the transformer up front validates src and dst before
+        # any work is handed to the workers
+        if transformer is None:
+            transformer = self.create(src, dst)
+
+        n_points = len(columns[0])
+        if n_points < self.threshold or self.workers < 2:
+            return transformer.transform_batch(columns)
+
+        start = time.perf_counter()
+        n_shards = min(self.workers, -(-n_points // self.threshold))
+        futures = [
+            self._pool().submit(
+                transformer.transform_batch, [column[part] for column in columns]
+            )
+            for part in _split(n_points, n_shards)
+        ]
+
+        # Reassemble the shards in their original order
+        results = [future.result() for future in futures]
+        output = []
+        for i in range(len(results[0])):
+            if results[0][i] is None:
+                output.append(None)
+                continue
+            column = []
+            for result in results:
+                column.extend(result[i])
+            output.append(column)
+
+        trace = TRACE.get()
+        if trace is not None:
+            trace.dimension = len(columns)
+            trace.points = n_points
+            trace.add_stage("shards", time.perf_counter() - start)
+
+        return tuple(output)
+
+    def shutdown(self):
+        """
+        Stop the worker threads
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
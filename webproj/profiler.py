@@ -0,0 +1,113 @@
+"""
+Sampling profiler for a running worker.
+
+The stacks of all threads in the process are sampled at a fixed interval
+from a background thread, without tracing hooks, so the overhead on the
+requests being profiled is small. The samples are aggregated as collapsed
+stacks, one line per distinct stack with frames from root to leaf separated
+by semicolons followed by the number of samples, which is the input format
+of flamegraph.pl, speedscope and similar tools.
+
+Only one profile can run at a time and its duration is limited, so a
+profile can safely be taken on a live instance. Configured with environment
+variables:
+
+    WEBPROJ_PROFILE_INTERVAL      sampling interval in milliseconds (default 5)
+    WEBPROJ_PROFILE_MAX_SECONDS   maximum duration of a profile (default 60)
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+INTERVAL = float(os.environ.get("WEBPROJ_PROFILE_INTERVAL", 5)) / 1000
+MAX_SECONDS = float(os.environ.get("WEBPROJ_PROFILE_MAX_SECONDS", 60))
+
+# Leaf frames of threads that are waiting for work rather than doing any
+_IDLE = {
+    ("threading", "Condition.wait"),
+    ("threading", "Thread._wait_for_tstate_lock"),
+    ("selectors", "EpollSelector.select"),
+    ("selectors", "KqueueSelector.select"),
+    ("selectors", "SelectSelector.select"),
+    ("queue", "Queue.get"),
+    ("queue", "SimpleQueue.get"),
+    ("logging.handlers", "QueueListener.dequeue"),
+}
+
+_LOCK = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    name = getattr(code, "co_qualname", code.co_name)
+    return (module, name)
+
+
+def _collapse(frame):
+    """
+    Stack of a frame as a tuple of frame names from root to leaf
+    """
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def profile(seconds, interval=INTERVAL, idle=False):
+    """
+    Sample the stacks of all other threads for a number of seconds.
+
+    Returns a Counter of stacks and the number of sampling rounds. Stacks of
+    idle threads are left out unless `idle` is True. Raises ProfilerBusy if
+    another profile is running.
+    """
+    if not _LOCK.acquire(blocking=False):
+        raise ProfilerBusy("A profile is already running")
+
+    try:
+        seconds = min(seconds, MAX_SECONDS)
+        caller = threading.get_ident()
+        stacks = Counter()
+        rounds = 0
+
+        def sample():
+            nonlocal rounds
+            sampler = threading.get_ident()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident in (sampler, caller):
+                        continue
+                    stack = _collapse(frame)
+                    if not idle and stack and stack[-1] in _IDLE:
+                        continue
+                    stacks[stack] += 1
+                rounds += 1
+                time.sleep(interval)
+
+        thread = threading.Thread(target=sample, name="webproj-profiler", daemon=True)
+        thread.start()
+        thread.join()
+    finally:
+        _LOCK.release()
+
+    return (stacks, rounds)
+
+
+def collapsed(stacks):
+    """
+    Format stacks in the collapsed stack format, heaviest first
+    """
+    return "".join(
+        ";".join(f"{module}:{name}" for (module, name) in stack) + f" {count}\n"
+        for stack, count in stacks.most_common()
+    )
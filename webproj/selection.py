@@ -0,0 +1,147 @@
+"""
+Selection of the fastest acceptable coordinate operation between two CRS's.
+
+PROJ often knows several operations between two CRS's that are equally
+accurate, but differ a lot in cost. When enabled with the environment
+variable WEBPROJ_FASTEST_PIPELINE, the candidate operations are filtered
+by accuracy and area of use and benchmarked on points in the area of use,
+after which the fastest one is used.
+
+An operation is acceptable when its accuracy is known and within
+WEBPROJ_PIPELINE_TOLERANCE metres (default 0) of the operation preferred by
+PROJ, and its area of use covers that of the preferred operation.
+"""
+import math
+import os
+import time
+import warnings
+
+from pyproj.transformer import Transformer, TransformerGroup
+
+ENABLED = "WEBPROJ_FASTEST_PIPELINE" in os.environ
+TOLERANCE = float(os.environ.get("WEBPROJ_PIPELINE_TOLERANCE", 0.0))
+
+# Number of sample points along each axis of the area of use
+_SAMPLES = 16
+
+# Number of timed runs per candidate; the fastest run counts
+_REPEAT = 5
+
+
+def _intersection(bounds_a, bounds_b):
+    (west, south, east, north) = (
+        max(bounds_a[0], bounds_b[0]),
+        max(bounds_a[1], bounds_b[1]),
+        min(bounds_a[2], bounds_b[2]),
+        min(bounds_a[3], bounds_b[3]),
+    )
+    if west >= east or south >= north:
+        return None
+
+    return (west, south, east, north)
+
+
+def _covers(outer, inner):
+    return (
+        outer[0] <= inner[0]
+        and outer[1] <= inner[1]
+        and outer[2] >= inner[2]
+        and outer[3] >= inner[3]
+    )
+
+
+def _sample_points(crs_from, bounds):
+    """
+    Regular grid of points within bounds, in the coordinates and axis order
+    of crs_from
+    """
+    (west, south, east, north) = bounds
+    lons = []
+    lats = []
+    for i in range(_SAMPLES):
+        for j in range(_SAMPLES):
+            lons.append(west + (east - west) * (i + 0.5) / _SAMPLES)
+            lats.append(south + (north - south) * (j + 0.5) / _SAMPLES)
+
+    geodetic = crs_from.geodetic_crs
+    to_src = Transformer.from_crs(geodetic, crs_from)
+    heights = [0.0] * len(lons)
+    if geodetic.axis_info[0].direction == "north":
+        return to_src.transform(lats, lons, heights)
+    return to_src.transform(lons, lats, heights)
+
+
+def _benchmark(transformer, points):
+    best = math.inf
+    for _ in range(_REPEAT):
+        start = time.perf_counter()
+        transformer.transform(*points)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def fastest_transformer(crs_from, crs_to, area_of_interest, tolerance=TOLERANCE):
+    """
+    Find the fastest acceptable operation from crs_from to crs_to.
+
+    Returns a tuple of the transformer and a description of the selection.
+    The transformer is None when the operation preferred by PROJ is the
+    fastest, or when there is no choice to make, in which case the
+    description is None as well.
+    """
+    with warnings.catch_warnings():
+        # warns when the best operation is unavailable due to missing grids
+        warnings.simplefilter("ignore")
+        group = TransformerGroup(crs_from, crs_to, area_of_interest=area_of_interest)
+
+    if len(group.transformers) < 2:
+        return (None, None)
+
+    preferred = group.transformers[0]
+    if preferred.accuracy < 0 or preferred.area_of_use is None:
+        # without a known accuracy there is nothing to compare with
+        return (None, None)
+
+    bounds = _intersection(
+        preferred.area_of_use.bounds,
+        (
+            area_of_interest.west_lon_degree,
+            area_of_interest.south_lat_degree,
+            area_of_interest.east_lon_degree,
+            area_of_interest.north_lat_degree,
+        ),
+    )
+    if bounds is None:
+        return (None, None)
+
+    candidates = [
+        transformer
+        for transformer in group.transformers
+        if 0 <= transformer.accuracy <= preferred.accuracy + tolerance
+        and transformer.area_of_use is not None
+        and _covers(transformer.area_of_use.bounds, bounds)
+    ]
+
+    points = _sample_points(crs_from, bounds)
+    timings = [_benchmark(transformer, points) for transformer in candidates]
+    fastest = timings.index(min(timings))
+
+    selection = {
+        "selected": candidates[fastest].description,
+        "candidates": [
+            {
+                "description": transformer.description,
+                "accuracy": transformer.accuracy,
+                "time": timing,
+            }
+            for transformer, timing in zip(candidates, timings)
+        ],
+    }
+
+    if candidates[fastest] is preferred:
+        return (None, selection)
+
+    # Transformers of a TransformerGroup share one PROJ object between all
+    # threads, so the selected operation is rebuilt as a thread-safe one
+    return (Transformer.from_pipeline(candidates[fastest].to_json()), selection)
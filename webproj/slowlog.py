@@ -0,0 +1,136 @@
+"""
+Structured log of slow requests.
+
+Requests that take longer than a threshold, and a random sample of all other
+requests, are logged as JSON lines with the route, CRS pair, dimension,
+transformer cache hit or miss and the time spent in each stage of the
+transformation. Records are handed to a background thread through a queue,
+so writing the log never blocks the event loop.
+
+Configured with environment variables:
+
+    WEBPROJ_SLOW_REQUEST_MS   threshold in milliseconds (default 1000)
+    WEBPROJ_SLOW_LOG_SAMPLE   fraction of other requests to log (default 0)
+    WEBPROJ_SLOW_LOG          file to write to (default is stderr)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+from datetime import datetime, timezone
+
+THRESHOLD = float(os.environ.get("WEBPROJ_SLOW_REQUEST_MS", 1000)) / 1000
+SAMPLE = float(os.environ.get("WEBPROJ_SLOW_LOG_SAMPLE", 0))
+
+LOGGER = logging.getLogger("webproj.slow")
+LOGGER.setLevel(logging.INFO)
+LOGGER.propagate = False
+
+_QUEUE = queue.SimpleQueue()
+LOGGER.addHandler(logging.handlers.QueueHandler(_QUEUE))
+
+if "WEBPROJ_SLOW_LOG" in os.environ:
+    _HANDLER = logging.FileHandler(os.environ["WEBPROJ_SLOW_LOG"], encoding="UTF-8")
+else:
+    _HANDLER = logging.StreamHandler()
+
+_LISTENER = logging.handlers.QueueListener(_QUEUE, _HANDLER)
+_LISTENER.start()
+atexit.register(_LISTENER.stop)
+
+# Trace of the request currently being handled
+TRACE = contextvars.ContextVar("webproj_trace", default=None)
+
+
+class Trace:
+    """
+    Details of the transformation work done while handling a request
+    """
+
+    __slots__ = ("src", "dst", "dimension", "points", "cache", "stages")
+
+    def __init__(self):
+        self.src = None
+        self.dst = None
+        self.dimension = None
+        self.points = None
+        self.cache = None
+        self.stages = {}
+
+    def add_transformer(self, src, dst, miss):
+        """
+        Record the use of the transformer from src to dst. The CRS pair of
+        the request is that of the first transformer used, unless the route
+        has set it, e.g. to several destinations separated by commas.
+        Transformers of other pairs, like the legs to a hub used by
+        helpers, are not recorded, and a miss is never turned into a hit.
+        """
+        if self.src is None:
+            (self.src, self.dst) = (src, dst)
+        if src != self.src or dst not in self.dst.split(","):
+            return
+        if miss:
+            self.cache = "miss"
+        elif self.cache is None:
+            self.cache = "hit"
+
+    def add_stage(self, name, duration):
+        """
+        Add time spent in a stage of the transformation
+        """
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+
+
+class SlowRequestMiddleware:
+    """
+    ASGI middleware that traces requests and logs the slow ones
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace()
+        token = TRACE.set(trace)
+        status_code = None
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - start
+            TRACE.reset(token)
+
+            slow = duration >= THRESHOLD
+            if slow or (SAMPLE > 0 and random.random() < SAMPLE):
+                route = scope.get("route")
+                record = {
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "method": scope["method"],
+                    "route": route.path if route is not None else scope["path"],
+                    "status": status_code,
+                    "duration": duration,
+                    "slow": slow,
+                    "src": trace.src,
+                    "dst": trace.dst,
+                    "dimension": trace.dimension,
+                    "points": trace.points,
+                    "cache": trace.cache,
+                    "stages": trace.stages,
+                }
+                LOGGER.info(json.dumps(record))
@@ -0,0 +1,323 @@
+"""
+Differential verification of the fast transformation paths.
+
+Random points within the area of use of the source CRS of each pair of
+compatible CRS's, limited to the area of interest of the region, are
+transformed one at a time with OptimusPrime.transform(), which serves the
+single coordinate entry-points and is the reference, and with each of the
+fast paths. For every path and pair the maximum deviation from the
+reference is reported together with the number of points where one of them
+returns inf or fails and the other doesn't, and the throughput relative to
+the reference. A fraction of the points is placed outside the area of use
+to exercise the handling of points that can't be transformed.
+
+Run as
+
+    python -m webproj.verify --points 10000 --paths batch,sharded,fanout
+
+The exit status is 1 if a path deviates more than --tolerance from the
+reference or handles failures differently. Pairs that can't be sampled,
+because the source CRS has no area of use in the region, are listed as
+skipped and don't count as failures.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from math import inf, isinf
+
+from fastapi import HTTPException
+import pyproj
+
+from webproj import api
+from webproj.api import HUBS, FanoutInput, MeshFactory, TransformerFactory
+from webproj.parallel import ShardedTransformer
+
+# Sharded transformer that shards every batch, to exercise the reassembly
+_SHARDED = ShardedTransformer(create=TransformerFactory.create, threshold=1)
+
+
+def _batch(src, dst, columns):
+    return TransformerFactory.create(src, dst).transform_batch(columns)
+
+
+def _sharded(src, dst, columns):
+    return _SHARDED.transform(src, dst, columns)
+
+
+def _fanout(src, dst, columns):
+    coordinates = [list(row) for row in zip(*columns)]
+    result = api.transformation_fanout(
+        src, FanoutInput(coordinates=coordinates, targets=[dst])
+    )
+    result = result[dst.upper()]
+    if "detail" in result:
+        raise ValueError(result["detail"])
+
+    rows = [
+        (
+            (coordinate["v1"], coordinate["v2"], coordinate["v3"], coordinate["v4"])
+            if coordinate is not None
+            else (inf, inf, inf, inf)
+        )
+        for coordinate in result["coordinates"]
+    ]
+    return tuple(list(column) for column in zip(*rows))
+
+
+def _approximate(src, dst, columns):
+    mesh = MeshFactory.create(src, dst)
+    if mesh is None:
+        return _batch(src, dst, columns)
+    return mesh.transform_batch(columns)
+
+
+# Fast paths, each transforming columns of coordinates from src to dst
+PATHS = {
+    "batch": _batch,
+    "sharded": _sharded,
+    "fanout": _fanout,
+    "approximate": _approximate,
+}
+
+
+def sample_points(src, dst, n_points, dimension=3, outside=0.05, seed=None):
+    """
+    Random coordinates in src within the area of use of src in the region
+    of the transformation to dst, given as columns. Points outside the area
+    of use of dst are kept, as the fast paths must fail on them like the
+    reference. A fraction `outside` of the points is placed around the
+    area. Returns None if the area is unknown.
+    """
+    # pylint: disable-next=protected-access
+    area = api._area_of_use(src, dst, source_only=True)
+    if area is None:
+        return None
+    (region, (west, south, east, north)) = area
+
+    rng = random.Random(seed)
+    lats = []
+    lons = []
+    for i in range(n_points):
+        if i < n_points * outside:
+            # anywhere in the area of use widened by its size on all sides
+            (width, height) = (east - west, north - south)
+            lats.append(rng.uniform(max(south - height, -90), min(north + height, 90)))
+            lons.append(rng.uniform(west - width, east + width))
+        else:
+            lats.append(rng.uniform(south, north))
+            lons.append(rng.uniform(west, east))
+    heights = [rng.uniform(-50.0, 500.0) for _ in range(n_points)]
+
+    # hubs have latitude first
+    to_src = TransformerFactory.create(HUBS[region], src)
+    (v1, v2, v3, _) = to_src.transform_batch((lats, lons, heights))
+    epochs = [rng.uniform(2000.0, 2030.0) for _ in range(n_points)]
+    rows = [
+        row[:dimension]
+        for row in zip(v1, v2, v3, epochs)
+        if not (isinf(row[0]) or isinf(row[1]))
+    ]
+    rng.shuffle(rows)
+    return tuple(list(column) for column in zip(*rows))
+
+
+def _reference(transformer, columns):
+    """
+    Transform points one at a time. Points are returned as 4-tuples, or as
+    "inf" or "error" when they can't be transformed.
+    """
+    results = []
+    for row in zip(*columns):
+        try:
+            # pylint: disable-next=protected-access
+            results.append(transformer.transform(api._make_4d(row)))
+        except HTTPException:
+            results.append("inf")
+        except Exception:  # pylint: disable=broad-except
+            results.append("error")
+
+    return results
+
+
+def _outcome(row):
+    if any(value is not None and isinf(value) for value in row):
+        return "inf"
+    return row
+
+
+def compare(reference, out):
+    """
+    Compare the reference results with the columns returned by a fast path,
+    or with an exception raised by it
+    """
+    report = {
+        "max_deviation": 0.0,
+        "identical": 0,
+        "inf_mismatches": 0,
+        "error_mismatches": 0,
+    }
+    if isinstance(out, Exception):
+        rows = ["error"] * len(reference)
+    else:
+        columns = (
+            column if column is not None else [None] * len(reference)
+            for column in api._make_4d(out)  # pylint: disable=protected-access
+        )
+        rows = [_outcome(row) for row in zip(*columns)]
+
+    for expected, row in zip(reference, rows):
+        if "error" in (expected, row):
+            if expected != row:
+                report["error_mismatches"] += 1
+            continue
+        if "inf" in (expected, row):
+            if expected != row:
+                report["inf_mismatches"] += 1
+            continue
+
+        for a, b in zip(expected, row):
+            if (a is None) != (b is None):
+                report["max_deviation"] = inf
+            elif a is not None:
+                report["max_deviation"] = max(report["max_deviation"], abs(a - b))
+        report["identical"] += list(expected) == list(row)
+
+    return report
+
+
+def verify_pair(src, dst, paths, n_points=1000, dimension=3, outside=0.05, seed=None):
+    """
+    Verify the fast paths for one pair of CRS's. Returns a list of reports,
+    one for each path, or a single report with the reason the pair is
+    skipped or failed.
+    """
+    try:
+        transformer = TransformerFactory.create(src, dst)
+        columns = sample_points(src, dst, n_points, dimension, outside, seed)
+    except HTTPException as error:
+        return [{"src": src, "dst": dst, "error": error.detail}]
+    except pyproj.exceptions.ProjError as error:
+        return [{"src": src, "dst": dst, "error": str(error)}]
+    if columns is None:
+        return [{"src": src, "dst": dst, "skipped": "No area of use in the region"}]
+    if not columns:
+        return [{"src": src, "dst": dst, "skipped": "No points in the area of use"}]
+
+    start = time.perf_counter()
+    reference = _reference(transformer, columns)
+    reference_time = time.perf_counter() - start
+
+    reports = []
+    for name in paths:
+        path = PATHS[name]
+        # build transformers and meshes before the timing
+        try:
+            path(src, dst, tuple(column[:1] for column in columns))
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+        start = time.perf_counter()
+        try:
+            out = path(src, dst, columns)
+        except Exception as error:  # pylint: disable=broad-except
+            out = error
+        elapsed = time.perf_counter() - start
+
+        report = {"src": src, "dst": dst, "path": name, "points": len(reference)}
+        report.update(compare(reference, out))
+        report["speedup"] = reference_time / elapsed if elapsed > 0 else inf
+        reports.append(report)
+
+    return reports
+
+
+def failed(report, tolerance):
+    """Whether a report shows a deviation or mismatch"""
+    if "skipped" in report:
+        return False
+    return (
+        "error" in report
+        or report["max_deviation"] > tolerance
+        or report["inf_mismatches"] > 0
+        or report["error_mismatches"] > 0
+    )
+
+
+def main(argv=None):
+    """
+    Entry point of the verification harness
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m webproj.verify",
+        description="Compare the fast transformation paths with the scalar reference.",
+    )
+    parser.add_argument(
+        "--pairs", help="CRS pairs as SRC/DST separated by commas (default is all)"
+    )
+    parser.add_argument(
+        "--paths",
+        default="batch,sharded",
+        help=f"fast paths to verify, any of {', '.join(PATHS)}",
+    )
+    parser.add_argument("--points", type=int, default=1000, help="points per pair")
+    parser.add_argument("--dimension", type=int, choices=(2, 3, 4), default=3)
+    parser.add_argument(
+        "--outside",
+        type=float,
+        default=0.05,
+        help="fraction of points outside the area",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--json", action="store_true", help="write reports as JSON lines"
+    )
+    args = parser.parse_args(argv)
+
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    unknown = set(paths) - set(PATHS)
+    if unknown:
+        parser.error(f"unknown paths: {', '.join(sorted(unknown))}")
+
+    pairs = api._warmup_pairs(args.pairs or "all")  # pylint: disable=protected-access
+
+    if not args.json:
+        print(
+            f"{'pair':<40} {'path':<12} {'points':>7} {'max dev':>10} "
+            f"{'identical':>9} {'inf':>5} {'error':>5} {'speedup':>8}"
+        )
+
+    n_failed = 0
+    skipped = []
+    for src, dst in pairs:
+        for report in verify_pair(
+            src, dst, paths, args.points, args.dimension, args.outside, args.seed
+        ):
+            n_failed += failed(report, args.tolerance)
+            if args.json:
+                print(json.dumps(report))
+            elif "skipped" in report:
+                skipped.append(report)
+            elif "error" in report:
+                print(f"{src + ' -> ' + dst:<40} {report['error']}")
+            else:
+                print(
+                    f"{src + ' -> ' + dst:<40} {report['path']:<12} "
+                    f"{report['points']:>7} {report['max_deviation']:>10.3g} "
+                    f"{report['identical']:>9} {report['inf_mismatches']:>5} "
+                    f"{report['error_mismatches']:>5} {report['speedup']:>8.2f}"
+                )
+
+    if skipped:
+        print(f"\nSkipped {len(skipped)} pairs:")
+        for report in skipped:
+            print(f"{report['src'] + ' -> ' + report['dst']:<40} {report['skipped']}")
+
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())